@@ -1,2 +1,6 @@
-from dsl.components import getOptionsList, getAllFunctionsAndOptionsList, evaluate, getFunctionOutput, getCompositeFunctionKeys, getFunctionInputs, getFunctionKeysWithLambda
-from dsl.program import Program, ProgramLine
+from dsl.components import getOptionsList, getAllFunctionsAndOptionsList, evaluate, getFunctionOutput, getCompositeFunctionKeys, getFunctionInputs, getFunctionKeysWithLambda, registry
+from dsl.program import Program, ProgramLine, CheckResult, OUT_OF_RANGE, EMPTY_OUTPUT
+from dsl.batch import ListBatch
+from dsl.table import ProgramTable
+from dsl.trie import PrefixTrie
+from dsl.rules import RulePruner
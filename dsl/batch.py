@@ -0,0 +1,269 @@
+import itertools
+import numpy as np
+
+# values up to this magnitude can go through any single elementwise dsl op in int64 without overflowing
+# beyond it a batch is promoted to object dtype so results stay exact, as in the tuple path
+SAFE_MAGNITUDE = 2**31
+
+class ListBatch:
+    # a batch of lists held as one padded int array plus a vector of lengths
+    # ints are held the same way as lists of width 1, with length 0 standing in for None
+    # (this mirrors the lineOutputs / lineOutputLengths encoding used by the z3 oracle)
+    def __init__(self, values, lengths):
+        self.values = values
+        self.lengths = lengths
+
+    @classmethod
+    def fromLists(cls, lists):
+        lists = [tuple(x) for x in lists]
+        lengths = np.fromiter((len(x) for x in lists), dtype=np.int64, count=len(lists))
+        width = int(lengths.max(initial=0))
+        flat = list(itertools.chain.from_iterable(lists))
+        try:
+            values = np.zeros((len(lists), width), dtype=np.int64)
+            values[activeMask(values, lengths)] = np.array(flat, dtype=np.int64)
+        except OverflowError:
+            values = np.zeros((len(lists), width), dtype=object)
+            values[activeMask(values, lengths)] = flat
+        return cls(values, lengths)
+
+    @classmethod
+    def fromInts(cls, ints):
+        ints = list(ints)
+        lengths = np.array([0 if x is None else 1 for x in ints], dtype=np.int64)
+        flat = [0 if x is None else x for x in ints]
+        try:
+            values = np.array(flat, dtype=np.int64).reshape(len(ints), 1)
+        except OverflowError:
+            values = np.array(flat, dtype=object).reshape(len(ints), 1)
+        return cls(values, lengths)
+
+    @classmethod
+    def fromValues(cls, values, valueType):
+        if valueType is list:
+            return cls.fromLists(values)
+        return cls.fromInts(values)
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def width(self):
+        return self.values.shape[1]
+
+    # a new batch holding just the given rows
+    def take(self, rows):
+        return ListBatch(self.values[rows], self.lengths[rows])
+
+    # row j as a plain python value, in the same form the tuple path produces
+    def getValue(self, j, valueType):
+        length = int(self.lengths[j])
+        if valueType is list:
+            return tuple(self.values[j, :length].tolist())
+        if length == 0:
+            return None
+        return self.values[j, 0].item() if self.values.dtype != object else self.values[j, 0]
+
+    def toLists(self):
+        return tuple(tuple(row[:l]) for row, l in zip(self.values.tolist(), self.lengths.tolist()))
+
+    def toInts(self):
+        return tuple(row[0] if l > 0 else None for row, l in zip(self.values.tolist(), self.lengths.tolist()))
+
+    def toValues(self, valueType):
+        if valueType is list:
+            return self.toLists()
+        return self.toInts()
+
+# rows holding some value outside the range [-255, 256], as checked by Program.runWithChecks
+def outOfRange(b):
+    values = b.values
+    return (activeMask(values, b.lengths) & ((values < -255) | (values > 256))).any(axis=1)
+
+def activeMask(values, lengths):
+    return np.arange(values.shape[1]) < lengths[:, None]
+
+# zero out the padding so it can't leak into later ops or overflow checks
+def makeBatch(values, lengths):
+    values = np.where(activeMask(values, lengths), values, 0)
+    if values.dtype != object:
+        values = values.astype(np.int64, copy=False)
+    return ListBatch(values, lengths)
+
+def exact(*batches):
+    # promote every batch to object dtype if any of them is too large for safe int64 arithmetic
+    for b in batches:
+        if b.values.dtype != object and b.values.size > 0 and np.abs(b.values).max() > SAFE_MAGNITUDE:
+            return tuple(ListBatch(x.values.astype(object), x.lengths) for x in batches)
+    return batches
+
+def gather(values, index):
+    if values.shape[1] == 0:
+        return np.zeros(index.shape, dtype=values.dtype)
+    return np.take_along_axis(values, np.clip(index, 0, values.shape[1]-1), axis=1)
+
+def intBatch(values, lengths):
+    return makeBatch(values.reshape(len(lengths), 1), lengths.astype(np.int64))
+
+def batchHead(inputs):
+    b = inputs[0]
+    return intBatch(gather(b.values, np.zeros((len(b), 1), dtype=np.int64)), (b.lengths > 0))
+
+def batchLast(inputs):
+    b = inputs[0]
+    return intBatch(gather(b.values, (b.lengths - 1)[:, None]), (b.lengths > 0))
+
+def batchTake(inputs):
+    n, b = inputs
+    count = takeCount(n, b.lengths)
+    return makeBatch(b.values, count)
+
+def batchDrop(inputs):
+    n, b = inputs
+    start = takeCount(n, b.lengths)
+    start = np.where(n.lengths == 0, 0, start)
+    index = start[:, None] + np.arange(b.width())
+    return makeBatch(gather(b.values, index), b.lengths - start)
+
+# python slice semantics for tuple(val)[:n], where a None n takes everything
+def takeCount(n, lengths):
+    k = n.values[:, 0]
+    count = np.where(k >= 0, np.minimum(k, lengths), np.maximum(lengths + k, 0))
+    return np.where(n.lengths == 0, lengths, count).astype(np.int64)
+
+def batchAccess(inputs):
+    n, b = inputs
+    k = n.values[:, 0]
+    valid = (n.lengths > 0) & (((k >= 0) & (b.lengths > k)) | ((k < 0) & (b.lengths >= -k)))
+    index = np.where(k >= 0, k, b.lengths + k).astype(np.int64)
+    return intBatch(gather(b.values, index[:, None]), valid)
+
+def batchMinimum(inputs):
+    b = inputs[0]
+    if b.values.size == 0:
+        return intBatch(np.zeros(len(b), dtype=np.int64), b.lengths > 0)
+    fill = b.values.max() + 1
+    return intBatch(np.where(activeMask(b.values, b.lengths), b.values, fill).min(axis=1), b.lengths > 0)
+
+def batchMaximum(inputs):
+    b = inputs[0]
+    if b.values.size == 0:
+        return intBatch(np.zeros(len(b), dtype=np.int64), b.lengths > 0)
+    fill = b.values.min() - 1
+    return intBatch(np.where(activeMask(b.values, b.lengths), b.values, fill).max(axis=1), b.lengths > 0)
+
+def batchSort(inputs):
+    b = inputs[0]
+    if b.values.size == 0:
+        return b
+    fill = b.values.max() + 1
+    return makeBatch(np.sort(np.where(activeMask(b.values, b.lengths), b.values, fill), axis=1), b.lengths)
+
+def batchReverse(inputs):
+    b = inputs[0]
+    index = b.lengths[:, None] - 1 - np.arange(b.width())
+    return makeBatch(gather(b.values, index), b.lengths)
+
+def batchFilter(inputs, option):
+    b = inputs[0]
+    keep = np.asarray(option(b.values), dtype=bool) & activeMask(b.values, b.lengths)
+    # stable sort moves the kept values to the front without changing their order
+    order = np.argsort(~keep, axis=1, kind='stable')
+    return makeBatch(np.take_along_axis(b.values, order, axis=1), keep.sum(axis=1))
+
+def batchCount(inputs, option):
+    b = inputs[0]
+    keep = np.asarray(option(b.values), dtype=bool) & activeMask(b.values, b.lengths)
+    return intBatch(keep.sum(axis=1), np.ones(len(b), dtype=np.int64))
+
+def batchSum(inputs):
+    b = inputs[0]
+    return intBatch(b.values.sum(axis=1), np.ones(len(b), dtype=np.int64))
+
+def batchMap(inputs, option):
+    b = inputs[0]
+    return makeBatch(option(b.values), b.lengths)
+
+def batchZipwith(inputs, option):
+    a, b = inputs
+    w = min(a.width(), b.width())
+    return makeBatch(option(a.values[:, :w], b.values[:, :w]), np.minimum(a.lengths, b.lengths))
+
+def batchScanL1(inputs, option):
+    b = inputs[0]
+    if b.values.size == 0:
+        return b
+    return makeBatch(option(b.values), b.lengths)
+
+def scanMinus(values):
+    # y_k = y_(k-1) - x_k unrolls to x_0 - (x_1 + ... + x_k)
+    return 2*values[:, :1] - np.cumsum(values, axis=1)
+
+def scanMult(values):
+    # cumulative products can outgrow int64 long before a single product does
+    if values.dtype != object and values.shape[1] > 1:
+        magnitude = int(np.abs(values).max())
+        if magnitude > 1 and np.log2(magnitude) * values.shape[1] > 62:
+            values = values.astype(object)
+    return np.cumprod(values, axis=1)
+
+boolOpts = {
+    '<0': lambda v: v < 0,
+    '>0': lambda v: v > 0,
+    '%2==0': lambda v: v%2 == 0,
+    '%2==1': lambda v: v%2 == 1,
+}
+
+intOpts = {
+    '+1': lambda v: v+1,
+    '-1': lambda v: v-1,
+    '*2': lambda v: v*2,
+    '/2': lambda v: v//2,
+    '*(-1)': lambda v: v*(-1),
+    '**2': lambda v: v**2,
+    '*3': lambda v: v*3,
+    '/3': lambda v: v//3,
+    '*4': lambda v: v*4,
+    '/4': lambda v: v//4,
+}
+
+pairOpts = {
+    '+': np.add,
+    '-': np.subtract,
+    '*': np.multiply,
+    'MIN': np.minimum,
+    'MAX': np.maximum,
+}
+
+scanOpts = {
+    '+': lambda v: np.cumsum(v, axis=1),
+    '-': scanMinus,
+    '*': scanMult,
+    'MIN': lambda v: np.minimum.accumulate(v, axis=1),
+    'MAX': lambda v: np.maximum.accumulate(v, axis=1),
+}
+
+functions = {
+    'HEAD': (None, batchHead),
+    'LAST': (None, batchLast),
+    'MINIMUM': (None, batchMinimum),
+    'MAXIMUM': (None, batchMaximum),
+    'SORT': (None, batchSort),
+    'REVERSE': (None, batchReverse),
+    'FILTER': (boolOpts, batchFilter),
+    'COUNT': (boolOpts, batchCount),
+    'SUM': (None, batchSum),
+    'MAP': (intOpts, batchMap),
+    'SCANL1': (scanOpts, batchScanL1),
+    'TAKE': (None, batchTake),
+    'DROP': (None, batchDrop),
+    'ACCESS': (None, batchAccess),
+    'ZIPWITH': (pairOpts, batchZipwith),
+}
+
+# same contract as components.evaluate, but over a list of ListBatch (one per line input)
+def evaluate(functionId, inputBatches, optionId = None):
+    options, execute = functions[functionId]
+    inputBatches = exact(*inputBatches)
+    if optionId:
+        return execute(inputBatches, options[optionId])
+    return execute(inputBatches)
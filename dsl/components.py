@@ -1,97 +1,117 @@
+import functools
+import types
 from collections import namedtuple
 
+# single-value versions of each dsl function, used by compiled programs
+# the exec functions below apply these across a batch of values
+def applyHead(val):
+    if len(val)>0:
+        return val[0]
+    return None
+
+def applyLast(val):
+    if len(val)>0:
+        return val[-1]
+    return None
+
+def applyTake(a, b):
+    return tuple(b)[:a]
+
+def applyDrop(a, b):
+    return tuple(b)[a:]
+
+def applyAccess(a, b):
+    if a is None:
+        return None
+    elif ((a>=0 and len(b)>a) or (a<0 and len(b)>=-a)):
+        return b[a]
+    return None
+
+def applyMinimum(val):
+    if len(val)>0:
+        return min(val)
+    return None
+
+def applyMaximum(val):
+    if len(val)>0:
+        return max(val)
+    return None
+
+def applySort(val):
+    return tuple(sorted(val))
+
+def applyReverse(val):
+    return tuple(val[::-1])
+
+def applyFilter(val, option):
+    return tuple(filter(option, val))
+
+def applyCount(val, option):
+    return len(tuple(filter(option, val)))
+
+def applySum(val):
+    return sum(val)
+
+def applyMap(val, option):
+    return tuple(map(option, val))
+
+def applyZipwith(a, b, option):
+    return tuple(option(x,y) for (x,y) in zip(a, b))
+
+def applyScanL1(val, option):
+    ret = []
+    if len(val) > 0:
+        y = val[0]
+        ret.append(y)
+        for x in val[1:]:
+            y = option(y, x)
+            ret.append(y)
+    return tuple(ret)
+
 def execHead(inputs):
-    out = []
-    for val in inputs:
-        ret = None
-        if len(val)>0:
-            ret = val[0]
-        out.append(ret)
-    return tuple(out)
+    return tuple(applyHead(val) for val in inputs)
 
 def execLast(inputs):
-    out = []
-    for val in inputs:
-        ret = None
-        if len(val)>0:
-            ret = val[-1]
-        out.append(ret)
-    return tuple(out)
+    return tuple(applyLast(val) for val in inputs)
 
 def execTake(inputs):
-    return tuple(tuple(val[1])[:val[0]] for val in inputs)
+    return tuple(applyTake(val[0], val[1]) for val in inputs)
 
 def execDrop(inputs):
-    return tuple(tuple(val[1])[val[0]:] for val in inputs)
+    return tuple(applyDrop(val[0], val[1]) for val in inputs)
 
 def execAccess(inputs):
-    out = []
-    for val in inputs:
-        a = val[0]
-        b = val[1]
-        if a is None:
-            ret = None
-        elif ((a>=0 and len(b)>a) or (a<0 and len(b)>=-a)):
-            ret = b[a]
-        else:
-            ret = None
-        out.append(ret)
-    return tuple(out)
+    return tuple(applyAccess(val[0], val[1]) for val in inputs)
 
 def execMinimum(inputs):
-    out = []
-    for val in inputs:
-        ret = None
-        if len(val)>0:
-            ret = min(val)
-        out.append(ret)
-    return tuple(out)
+    return tuple(applyMinimum(val) for val in inputs)
 
 def execMaximum(inputs):
-    out = []
-    for val in inputs:
-        ret = None
-        if len(val)>0:
-            ret = max(val)
-        out.append(ret)
-    return tuple(out)
+    return tuple(applyMaximum(val) for val in inputs)
 
 def execSort(inputs):
-    return tuple(tuple(sorted(val)) for val in inputs)
+    return tuple(applySort(val) for val in inputs)
 
 def execReverse(inputs):
-    return tuple(tuple(val[::-1]) for val in inputs)
+    return tuple(applyReverse(val) for val in inputs)
 
 def execFilter(inputs, option):
-    return tuple(tuple(filter(option, val)) for val in inputs)
+    return tuple(applyFilter(val, option) for val in inputs)
 
 def execCount(inputs, option):
-    return tuple(len(tuple(filter(option, val))) for val in inputs)
+    return tuple(applyCount(val, option) for val in inputs)
 
 def execSum(inputs):
-    out = []
-    for val in inputs:
-        out.append(sum(val))
-    return tuple(out)
+    return tuple(applySum(val) for val in inputs)
 
 def execMap(inputs, option):
-    return tuple(tuple(map(option,val)) for val in inputs)
+    return tuple(applyMap(val, option) for val in inputs)
 
 def execZipwith(inputs, option):
-    return tuple(tuple(option(x,y) for (x,y) in zip(val[0],val[1])) for val in inputs)
+    return tuple(applyZipwith(val[0], val[1], option) for val in inputs)
 
 def execScanL1(inputs, option):
-    out = []
-    for val in inputs:
-        ret = []
-        if len(val) > 0:
-            y = val[0]
-            ret.append(y)
-            for x in val[1:]:
-                y = option(y, x)
-                ret.append(y)
-        out.append(tuple(ret))
-    return tuple(out)
+    return tuple(applyScanL1(val, option) for val in inputs)
 
 Function = namedtuple('Function', ['options', 'inputTypes', 'outputType', 'execute'])
 
@@ -141,20 +161,83 @@ functions = {
     'ZIPWITH': Function(pairOpts, (list,list), list, execZipwith),
 }
 
+singleFunctions = {
+    'HEAD': applyHead,
+    'LAST': applyLast,
+    'MINIMUM': applyMinimum,
+    'MAXIMUM': applyMaximum,
+    'SORT': applySort,
+    'REVERSE': applyReverse,
+    'FILTER': applyFilter,
+    'COUNT': applyCount,
+    'SUM': applySum,
+    'MAP': applyMap,
+    'SCANL1': applyScanL1,
+    'TAKE': applyTake,
+    'DROP': applyDrop,
+    'ACCESS': applyAccess,
+    'ZIPWITH': applyZipwith,
+}
+
+class FunctionRegistry:
+    # every composite function (e.g. 'MAP,*2') gets a dense integer opcode, in the same order as getCompositeFunctions
+    # per-opcode data lives in tuples so lookups are plain indexing, and it's all built once at import
+    __slots__ = ('keys', 'opcodes', 'functionIds', 'optionIds', 'arity', 'inputTypes', 'outputType', 'executors')
+
+    def __init__(self):
+        keys = []
+        functionIds = []
+        optionIds = []
+        executors = []
+        for fk, f in functions.items():
+            if f.options:
+                for ok, o in f.options.items():
+                    keys.append(fk+','+ok)
+                    functionIds.append(fk)
+                    optionIds.append(ok)
+                    executors.append(functools.partial(f.execute, option=o.execute))
+            else:
+                keys.append(fk)
+                functionIds.append(fk)
+                optionIds.append(None)
+                executors.append(f.execute)
+        self.keys = tuple(keys)
+        self.opcodes = types.MappingProxyType({k: i for i, k in enumerate(keys)})
+        self.functionIds = tuple(functionIds)
+        self.optionIds = tuple(optionIds)
+        self.inputTypes = tuple(functions[fk].inputTypes for fk in functionIds)
+        self.arity = tuple(len(t) for t in self.inputTypes)
+        self.outputType = tuple(functions[fk].outputType for fk in functionIds)
+        self.executors = tuple(executors)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def getOpcode(self, functionId, optionId = None):
+        if optionId is not None:
+            functionId = functionId+','+optionId
+        return self.opcodes[functionId]
+
+    # accepts either an opcode or a composite function string
+    def toOpcode(self, function):
+        if isinstance(function, int):
+            return function
+        return self.opcodes[function]
+
+registry = FunctionRegistry()
+
 def getCompositeFunctionKeys():
-    return list(getCompositeFunctions().keys())
+    return list(registry.keys)
 
 def getCompositeFunctions():
     # loop thru functions and pair with options to get the full list
     compositeFunctions = {}
-    for fk, f in functions.items():
-        opts = f.options
-        if opts:
-            for ok, o in opts.items():
-                id = fk+','+ok
-                compositeFunctions[id] = Function(None, f.inputTypes, f.outputType, lambda inputs: f.execute(inputs, o.execute))
+    for op, id in enumerate(registry.keys):
+        f = functions[registry.functionIds[op]]
+        if registry.optionIds[op] is not None:
+            compositeFunctions[id] = Function(None, f.inputTypes, f.outputType, registry.executors[op])
         else:
-            compositeFunctions[fk] = f
+            compositeFunctions[id] = f
     return compositeFunctions
 
 def getAllFunctionsAndOptionsList():
@@ -182,17 +265,13 @@ def evaluate(functionId, inputValues, optionId = None):
     return out
 
 def getFunctionOutput(functionId):
-    try:
-        out = functions[functionId].outputType
-    except:
-        cfuncs = getCompositeFunctions()
-        out = cfuncs[functionId].outputType
-    return out
+    f = functions.get(functionId)
+    if f is not None:
+        return f.outputType
+    return registry.outputType[registry.toOpcode(functionId)]
 
 def getFunctionInputs(functionId):
-    try:
-        intypes = functions[functionId].inputTypes
-    except:
-        cfuncs = getCompositeFunctions()
-        intypes = cfuncs[functionId].inputTypes
-    return intypes
+    f = functions.get(functionId)
+    if f is not None:
+        return f.inputTypes
+    return registry.inputTypes[registry.toOpcode(functionId)]
@@ -1,8 +1,35 @@
 import ast
+import numpy as np
 from collections import namedtuple
 from dsl import components
+from dsl import batch
+
+# true if a line output or program input value falls outside the range [-255, 256]
+def valueOutOfRange(value):
+    if isinstance(value, (tuple, list)):
+        for list_val in value:
+            if list_val < -255 or list_val > 256:
+                return True
+    elif value is not None:
+        if value < -255 or value > 256:
+            return True
+    return False
+
+ProgramInput = namedtuple('Input', ['name', 'type'])
+
+# result of a fail-fast checked run: failedLine is the line (or negative input ref) that failed, None if all passed
+CheckResult = namedtuple('CheckResult', ['output', 'failedLine', 'reason'])
+OUT_OF_RANGE = 'out of range'
+EMPTY_OUTPUT = 'empty output'
+
+def refName(ref):
+    if ref < 0:
+        return 'i'+str(-ref-1)
+    return 'x'+str(ref)
 
 class ProgramLine:
+    __slots__ = ('function', 'option', 'inputRefs')
+
     def __init__(self, function = '', inputRefs = [], option = None):
         self.function = function
         self.option = option
@@ -30,6 +57,10 @@ class ProgramLine:
                         break
         return newLine
 
+    @property
+    def opcode(self):
+        return components.registry.getOpcode(self.function, self.option)
+
     def toString(self, inputMapping):
         lineInputStrings = []
         for lineIn in self.inputRefs:
@@ -55,9 +86,28 @@ class ProgramLine:
             else: allData += actualData
         return components.evaluate(self.function, allData, self.option)
 
+    # source for this line in a compiled program, plus the names it needs from the namespace
+    def compileLine(self, lineNumber):
+        fName = 'f'+str(lineNumber)
+        namespace = {fName: components.singleFunctions[self.function]}
+        args = [refName(r) for r in self.inputRefs]
+        if self.option is not None:
+            oName = 'o'+str(lineNumber)
+            namespace[oName] = components.functions[self.function].options[self.option].execute
+            args.append(oName)
+        return refName(lineNumber)+' = '+fName+'('+', '.join(args)+')', namespace
+
+    # as evaluateLineMany, but values holds one ListBatch per line output / program input
+    def evaluateLineBatch(self, values):
+        return batch.evaluate(self.function, [values[d] for d in self.inputRefs], self.option)
+
 class Program:
+    # runMany switches to the numpy batch executor for at least this many input sets
+    batchThreshold = 1000
+
+    __slots__ = ('inputs', 'lines')
+
     def __init__(self, inputTypes = [], lineFunctions = [], lineInputRefs = []):
-        ProgramInput = namedtuple('Input', ['name', 'type'])
         self.inputs = []
         i = 1
         for t in inputTypes:
@@ -66,13 +116,12 @@ class Program:
             self.inputs.append(ProgramInput(name, t))
             i += 1
         self.lines = []
+        # line functions can be given as composite function strings or registry opcodes
+        registry = components.registry
         for fn in lineFunctions:
-            fnParts = fn.split(',')
-            f = fnParts[0]
-            o = None
-            if len(fnParts) == 2: o = fnParts[1]
-            n = len(components.getFunctionInputs(f))
-            self.lines.append(ProgramLine(f, lineInputRefs[:n], o))
+            op = registry.toOpcode(fn)
+            n = registry.arity[op]
+            self.lines.append(ProgramLine(registry.functionIds[op], lineInputRefs[:n], registry.optionIds[op]))
             del lineInputRefs[:n]
 
     def getNumberOfListInputs(self):
@@ -100,6 +149,9 @@ class Program:
     # evaluate program on several input sets at once
     # order of inputs within a set must match program.inputs
     def runMany(self, programInputValues):
+        programInputValues = list(programInputValues)
+        if len(programInputValues) >= self.batchThreshold:
+            return self.runManyBatched(programInputValues)
         lineOutputValues = []
         for progIns in programInputValues:
             lineOutputValues.append([None]*len(self.lines) + list(progIns[::-1]))
@@ -109,26 +161,113 @@ class Program:
                 lineOutputValues[j][i] = fullOut[j]
         return tuple(x[len(self.lines)-1] for x in lineOutputValues)
 
+    # same results as runMany, but each line runs once over the whole batch with numpy
+    def runManyBatched(self, programInputValues):
+        programInputValues = list(programInputValues)
+        inputBatches = []
+        for i, progIn in enumerate(self.inputs):
+            inputBatches.append(batch.ListBatch.fromValues([x[i] for x in programInputValues], progIn.type))
+        lineOutputValues = [None]*len(self.lines) + inputBatches[::-1]
+        for i, line in enumerate(self.lines):
+            lineOutputValues[i] = line.evaluateLineBatch(lineOutputValues)
+        return lineOutputValues[len(self.lines)-1].toValues(self.getOutputType())
+
     # ensures that the inputs given do not go outside the range [-255, 256]
     def runWithChecks(self, programInputValues, outputNotEmpty = True):
-        lineOutputValues = self.runFullOutput(programInputValues)
+        result = self.runChecked(programInputValues, outputNotEmpty)
+        if result.reason is not None:
+            return False
+        return result.output
 
-        for lineOut in lineOutputValues:
-            if isinstance(lineOut, (tuple, list)):
-                for list_val in lineOut:
-                    if list_val < -255 or list_val > 256:
-                        return False
-            else:
-                if lineOut is not None:
-                    if lineOut < -255 or lineOut > 256:
-                        return False
+    # like runWithChecks, but stops at the first value that fails and reports where and why
+    def runChecked(self, programInputValues, outputNotEmpty = True):
+        for i, inputValue in enumerate(programInputValues):
+            if valueOutOfRange(inputValue):
+                return CheckResult(None, -i-1, OUT_OF_RANGE)
+        lineOutputValues = [None]*len(self.lines) + list(programInputValues[::-1])
+        for i, line in enumerate(self.lines):
+            lineOutputValues[i] = line.evaluateLine(lineOutputValues)
+            if valueOutOfRange(lineOutputValues[i]):
+                return CheckResult(None, i, OUT_OF_RANGE)
 
         progOutput = lineOutputValues[len(self.lines)-1]
         if outputNotEmpty:
             if progOutput is None or progOutput == ():
-                return False
+                return CheckResult(None, len(self.lines)-1, EMPTY_OUTPUT)
+
+        return CheckResult(progOutput, None, None)
 
-        return progOutput
+    # runWithChecks over many input sets at once, using the numpy batch executor
+    # returns a boolean acceptance mask and a ListBatch of outputs (rejected rows are left empty)
+    def runWithChecksMany(self, programInputValues, outputNotEmpty = True):
+        programInputValues = list(programInputValues)
+        inputBatches = []
+        for i, progIn in enumerate(self.inputs):
+            inputBatches.append(batch.ListBatch.fromValues([x[i] for x in programInputValues], progIn.type))
+        return self.runWithChecksBatch(inputBatches, outputNotEmpty)
+
+    # as runWithChecksMany, but takes one ListBatch per program input
+    # rows are dropped as soon as they fail, so later lines only run on the survivors
+    def runWithChecksBatch(self, inputBatches, outputNotEmpty = True):
+        n = len(self.lines)
+        size = len(inputBatches[0])
+        alive = np.ones(size, dtype=bool)
+        for b in inputBatches:
+            alive &= ~batch.outOfRange(b)
+        rows = np.flatnonzero(alive)
+        lineOutputValues = [None]*n + [b.take(rows) for b in inputBatches[::-1]]
+        for i, line in enumerate(self.lines):
+            lineOutputValues[i] = line.evaluateLineBatch(lineOutputValues)
+            keep = ~batch.outOfRange(lineOutputValues[i])
+            if outputNotEmpty and i == n-1:
+                keep &= lineOutputValues[i].lengths > 0
+            if not keep.all():
+                rows = rows[keep]
+                lineOutputValues = [None if v is None else v.take(keep) for v in lineOutputValues]
+        out = lineOutputValues[n-1]
+        accepted = np.zeros(size, dtype=bool)
+        accepted[rows] = True
+        outputs = batch.ListBatch(np.zeros((size, out.width()), dtype=out.values.dtype), np.zeros(size, dtype=np.int64))
+        outputs.values[rows] = out.values
+        outputs.lengths[rows] = out.lengths
+        return accepted, outputs
+
+    # build a single python function for this program, with function lookups, options and input refs resolved once
+    # mode 'run' behaves like run, 'checked' like runWithChecks, 'report' like runChecked and 'trace' like runFullOutput
+    def compile(self, mode = 'run'):
+        assert(mode in ['run', 'checked', 'report', 'trace'])
+        n = len(self.lines)
+        namespace = {'valueOutOfRange': valueOutOfRange, 'CheckResult': CheckResult}
+        fail = {
+            'checked': lambda line, reason: 'return False',
+            'report': lambda line, reason: 'return CheckResult(None, '+str(line)+', '+repr(reason)+')',
+        }.get(mode)
+        if fail:
+            source = ['def compiled(programInputValues, outputNotEmpty = True):']
+        else:
+            source = ['def compiled(programInputValues):']
+        for i in range(len(self.inputs)):
+            source.append('    i'+str(i)+' = programInputValues['+str(i)+']')
+            if fail:
+                source.append('    if valueOutOfRange(i'+str(i)+'): '+fail(-i-1, OUT_OF_RANGE))
+        for i, line in enumerate(self.lines):
+            lineSource, lineNamespace = line.compileLine(i)
+            namespace.update(lineNamespace)
+            source.append('    '+lineSource)
+            if fail:
+                source.append('    if valueOutOfRange(x'+str(i)+'): '+fail(i, OUT_OF_RANGE))
+        out = refName(n-1)
+        if fail:
+            source.append('    if outputNotEmpty and ('+out+' is None or '+out+' == ()): '+fail(n-1, EMPTY_OUTPUT))
+        if mode == 'trace':
+            allValues = [refName(i) for i in range(n)] + [refName(-i-1) for i in range(len(self.inputs))][::-1]
+            source.append('    return ['+', '.join(allValues)+']')
+        elif mode == 'report':
+            source.append('    return CheckResult('+out+', None, None)')
+        else:
+            source.append('    return '+out)
+        exec('\n'.join(source), namespace)
+        return namespace['compiled']
 
     def runAndCollectStats(self, programInputValues):
         lineOutputValues = self.runFullOutput(programInputValues)
@@ -224,7 +363,6 @@ class Program:
 
     @classmethod
     def fromString(cls, progString):
-        ProgramInput = namedtuple('Input', ['name', 'type'])
         p = cls()
         # clean input
         if progString[-1] == '\n':
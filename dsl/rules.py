@@ -0,0 +1,80 @@
+from collections import namedtuple
+from dsl import components
+
+# a candidate matching a rule computes something the enumeration has already covered
+#   'commutative': function takes its two inputs in the opposite order to the one getLineInputs tries first,
+#                  so the same program with them swapped came just before it
+#   'compose':     function is applied directly to the output of a line applying inner,
+#                  which is the same as that line's output (idempotent) or its input (involution / inverse)
+Rule = namedtuple('Rule', ['name', 'kind', 'function', 'inner'])
+
+rules = [
+    Rule('ZIPWITH + commutes', 'commutative', 'ZIPWITH,+', None),
+    Rule('ZIPWITH * commutes', 'commutative', 'ZIPWITH,*', None),
+    Rule('ZIPWITH MIN commutes', 'commutative', 'ZIPWITH,MIN', None),
+    Rule('ZIPWITH MAX commutes', 'commutative', 'ZIPWITH,MAX', None),
+    Rule('SORT after SORT', 'compose', 'SORT', 'SORT'),
+    Rule('FILTER <0 after FILTER <0', 'compose', 'FILTER,<0', 'FILTER,<0'),
+    Rule('FILTER >0 after FILTER >0', 'compose', 'FILTER,>0', 'FILTER,>0'),
+    Rule('FILTER %2==0 after FILTER %2==0', 'compose', 'FILTER,%2==0', 'FILTER,%2==0'),
+    Rule('FILTER %2==1 after FILTER %2==1', 'compose', 'FILTER,%2==1', 'FILTER,%2==1'),
+    Rule('REVERSE after REVERSE', 'compose', 'REVERSE', 'REVERSE'),
+    Rule('MAP *(-1) after MAP *(-1)', 'compose', 'MAP,*(-1)', 'MAP,*(-1)'),
+    Rule('MAP -1 after MAP +1', 'compose', 'MAP,-1', 'MAP,+1'),
+    Rule('MAP +1 after MAP -1', 'compose', 'MAP,+1', 'MAP,-1'),
+    # only this way round, (x//k)*k loses the remainder
+    Rule('MAP /2 after MAP *2', 'compose', 'MAP,/2', 'MAP,*2'),
+    Rule('MAP /3 after MAP *3', 'compose', 'MAP,/3', 'MAP,*3'),
+    Rule('MAP /4 after MAP *4', 'compose', 'MAP,/4', 'MAP,*4'),
+]
+
+# position of a value in the order getLineInputs offers them: program inputs first, then line outputs
+def refOrder(ref):
+    if ref < 0:
+        return (0, -ref)
+    return (1, ref)
+
+class RulePruner:
+    # matches enumerated candidates against a rule table, counting how many each rule removes
+    # with verify set, the caller also runs each removed candidate and records (in notEquivalent)
+    # any the equivalence checker would have kept
+    def __init__(self, ruleTable = rules, verify = False):
+        registry = components.registry
+        self.rules = list(ruleTable)
+        self.verify = verify
+        self.removed = [0]*len(self.rules)
+        self.notEquivalent = [0]*len(self.rules)
+        # rules by the opcode of the line they fire on
+        self.rulesByFunction = {}
+        for r, rule in enumerate(self.rules):
+            inner = None if rule.inner is None else registry.toOpcode(rule.inner)
+            self.rulesByFunction.setdefault(registry.toOpcode(rule.function), []).append((r, rule.kind, inner))
+
+    # the lines of a skeleton that some rule could fire on, as (line, rules), so most skeletons skip matching altogether
+    def getLineRules(self, skeletonProgram):
+        lineRules = []
+        for i, op in enumerate(skeletonProgram):
+            lineFunctionRules = self.rulesByFunction.get(op)
+            if lineFunctionRules is not None:
+                lineRules.append((i, lineFunctionRules))
+        return lineRules
+
+    # index of the first rule the candidate matches, or None
+    def match(self, skeletonProgram, lineInputRefs, lineRules):
+        arity = components.registry.arity
+        starts = [0]
+        for op in skeletonProgram:
+            starts.append(starts[-1] + arity[op])
+        for i, lineFunctionRules in lineRules:
+            refs = lineInputRefs[starts[i]:starts[i+1]]
+            for r, kind, inner in lineFunctionRules:
+                if kind == 'commutative':
+                    if refOrder(refs[0]) > refOrder(refs[1]):
+                        return r
+                elif refs[0] >= 0 and skeletonProgram[refs[0]] == inner:
+                    return r
+        return None
+
+    # rule name: (candidates removed, removed candidates that turned out not to be equivalent)
+    def getCounts(self):
+        return {rule.name: (self.removed[r], self.notEquivalent[r]) for r, rule in enumerate(self.rules)}
@@ -0,0 +1,138 @@
+import ast
+import numpy as np
+from dsl import components
+from dsl.program import Program, ProgramLine, ProgramInput
+
+# marks an unused input slot (and padding lines) in the refs array
+NO_REF = 127
+
+class ProgramTable:
+    # struct-of-arrays store for a large set of programs
+    # row i is program ids[i], with inputs given by signatures[signatureIds[i]]
+    # and numLines[i] lines, each an opcode from components.registry plus up to two input refs
+    # slicing with a python slice returns views onto the same arrays, so it never copies
+    def __init__(self, ids, signatureIds, numLines, opcodes, refs, signatures):
+        self.ids = ids
+        self.signatureIds = signatureIds
+        self.numLines = numLines
+        self.opcodes = opcodes
+        self.refs = refs
+        self.signatures = signatures
+
+    @classmethod
+    def fromRows(cls, rows):
+        # rows are (id, inputTypes, lineOpcodes, lineInputRefs), with lineInputRefs one tuple per line
+        rows = list(rows)
+        signatures = []
+        signatureIndex = {}
+        maxLines = max([len(r[2]) for r in rows], default=0)
+        ids = np.empty(len(rows), dtype=np.int64)
+        signatureIds = np.empty(len(rows), dtype=np.int8)
+        numLines = np.empty(len(rows), dtype=np.int8)
+        opcodes = np.full((len(rows), maxLines), -1, dtype=np.int16)
+        refs = np.full((len(rows), maxLines, 2), NO_REF, dtype=np.int8)
+        for i, (progId, inputTypes, lineOpcodes, lineInputRefs) in enumerate(rows):
+            inputTypes = tuple(inputTypes)
+            if inputTypes not in signatureIndex:
+                signatureIndex[inputTypes] = len(signatures)
+                signatures.append(inputTypes)
+            ids[i] = progId
+            signatureIds[i] = signatureIndex[inputTypes]
+            numLines[i] = len(lineOpcodes)
+            opcodes[i, :len(lineOpcodes)] = lineOpcodes
+            for j, lineRefs in enumerate(lineInputRefs):
+                refs[i, j, :len(lineRefs)] = lineRefs
+        return cls(ids, signatureIds, numLines, opcodes, refs, tuple(signatures))
+
+    @classmethod
+    def fromPrograms(cls, programs, ids = None):
+        if ids is None:
+            ids = [-1]*len(programs)
+        rows = []
+        for progId, p in zip(ids, programs):
+            rows.append((progId, [x.type for x in p.inputs], [l.opcode for l in p.lines], [tuple(l.inputRefs) for l in p.lines]))
+        return cls.fromRows(rows)
+
+    # accepts the nProgs.txt line format, with or without the leading program id
+    @classmethod
+    def fromStrings(cls, progStrings):
+        inputDicts = {}
+        rows = []
+        for progString in progStrings:
+            progString = progString.rstrip('\n')
+            if not progString:
+                continue
+            parts = progString.split('\\')
+            progId = -1
+            if parts[0][0] != '{':
+                progId = int(parts[0])
+                parts = parts[1:]
+            inputTypes = inputDicts.get(parts[0])
+            if inputTypes is None:
+                inputTypes = []
+                for i, (inName, inType) in enumerate(ast.literal_eval(parts[0]).items()):
+                    if inName != 'I'+str(i+1):
+                        raise ValueError('ProgramTable expects inputs named I1..In: {}'.format(progString))
+                    inputTypes.append(list if inType == 'list' else int)
+                inputTypes = tuple(inputTypes)
+                inputDicts[parts[0]] = inputTypes
+            lineOpcodes = []
+            lineInputRefs = []
+            for l in parts[1:]:
+                f, o, ins = l.split(',')
+                lineOpcodes.append(components.registry.getOpcode(f, o or None))
+                lineInputRefs.append(tuple(int(x[1:])-1 if x[0] == 'X' else -int(x[1:]) for x in ins.split()))
+            rows.append((progId, inputTypes, lineOpcodes, lineInputRefs))
+        return cls.fromRows(rows)
+
+    @classmethod
+    def fromFile(cls, fileName):
+        with open(fileName, 'r', encoding='utf-8') as f:
+            return cls.fromStrings(f)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            return self.getProgram(index)
+        # slices give views, index arrays and masks give (compact) copies
+        return ProgramTable(self.ids[index], self.signatureIds[index], self.numLines[index], self.opcodes[index], self.refs[index], self.signatures)
+
+    # program strings in the same format as nProgs.txt, so a table can stand in for readlines()
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.toString(i)+'\n'
+
+    def getInputTypes(self, index):
+        return self.signatures[self.signatureIds[index]]
+
+    def getLineRefs(self, index, line):
+        return tuple(int(r) for r in self.refs[index, line] if r != NO_REF)
+
+    def getProgram(self, index):
+        registry = components.registry
+        p = Program()
+        for i, t in enumerate(self.getInputTypes(index)):
+            p.inputs.append(ProgramInput('I'+str(i+1), t))
+        for j in range(self.numLines[index]):
+            op = int(self.opcodes[index, j])
+            p.lines.append(ProgramLine(registry.functionIds[op], list(self.getLineRefs(index, j)), registry.optionIds[op]))
+        return p
+
+    # formats directly from the arrays, matching Program.toString with the id prefix used in program files
+    def toString(self, index):
+        registry = components.registry
+        inputDict = {}
+        for i, t in enumerate(self.getInputTypes(index)):
+            inputDict['I'+str(i+1)] = t.__name__
+        lines = []
+        for j in range(self.numLines[index]):
+            op = int(self.opcodes[index, j])
+            o = registry.optionIds[op] or ''
+            refs = ['I'+str(-r) if r < 0 else 'X'+str(r+1) for r in self.getLineRefs(index, j)]
+            lines.append(registry.functionIds[op]+','+o+','+' '.join(refs))
+        progString = str(inputDict)+'\\'+'\\'.join(lines)
+        if self.ids[index] >= 0:
+            progString = str(self.ids[index])+'\\'+progString
+        return progString
@@ -0,0 +1,76 @@
+from dsl import batch
+from dsl import components
+
+class PrefixTrieNode:
+    __slots__ = ('output', 'opcode', 'children')
+
+    def __init__(self, output):
+        # output of this node's line on every input set in the bank
+        self.output = output
+        # children are only kept for one opcode at a time, see PrefixTrie
+        self.opcode = None
+        self.children = {}
+
+class PrefixTrie:
+    # evaluates programs on a fixed bank of input sets, caching the outputs of every line of a program prefix
+    # node k levels down holds the outputs of line k-1, keyed by that line's (opcode, input refs)
+    # so a program whose first n-1 lines have been seen before only costs its last line
+    #
+    # programs are expected to arrive in the order getAllUpToMLines enumerates them,
+    # where every skeleton sharing a prefix comes in one block with the next opcode only ever increasing.
+    # each node only keeps the children for the opcode it saw last, which keeps the trie to the live path.
+    # other orders still give the right outputs, just with less reuse
+    #
+    # batched keeps each node's outputs as a ListBatch and runs lines with the numpy batch executor,
+    # which is quicker once the bank holds more than a few dozen input sets
+    def __init__(self, inputValues, batched = False):
+        # inputValues holds one tuple per program input, with that input's value for every input set
+        self.batched = batched
+        if batched:
+            inputValues = [batch.ListBatch.fromValues(v, list if isinstance(v[0], (list, tuple)) else int) for v in inputValues]
+        self.inputOutputs = list(inputValues[::-1])
+        self.root = PrefixTrieNode(None)
+
+    # outputs of the program's last line on every input set, as a tuple in the same form as Program.runMany
+    # lineFunctions are registry opcodes, lineInputRefs the flattened input refs of all lines
+    def evaluate(self, lineFunctions, lineInputRefs):
+        registry = components.registry
+        # same layout as lineOutputValues in Program.runFullOutput, but holding whole columns
+        lineOutputs = []
+        node = self.root
+        start = 0
+        last = len(lineFunctions) - 1
+        for i, op in enumerate(lineFunctions):
+            end = start + registry.arity[op]
+            refs = tuple(lineInputRefs[start:end])
+            start = end
+            if i == last:
+                return self.toValues(op, self.evaluateLine(op, refs, lineOutputs))
+            if node.opcode != op:
+                node.opcode = op
+                node.children = {}
+            child = node.children.get(refs)
+            if child is None:
+                child = PrefixTrieNode(self.evaluateLine(op, refs, lineOutputs))
+                node.children[refs] = child
+            node = child
+            lineOutputs.append(node.output)
+
+    # a line's outputs as held in the trie, in the form Program.runMany gives them
+    def toValues(self, op, out):
+        if self.batched:
+            return out.toValues(components.registry.outputType[op])
+        return out
+
+    # outputs of one line, in the same form the trie holds them
+    def evaluateLine(self, op, refs, lineOutputs):
+        # program inputs sit at the end, so negative refs index straight into values
+        values = lineOutputs + self.inputOutputs
+        if self.batched:
+            registry = components.registry
+            return batch.evaluate(registry.functionIds[op], [values[r] for r in refs], registry.optionIds[op])
+        if len(refs) > 1:
+            data = tuple(zip(*[values[r] for r in refs]))
+        else:
+            data = values[refs[0]]
+        return components.registry.executors[op](data)
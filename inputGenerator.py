@@ -1,8 +1,185 @@
 import z3InputsOracle
 import dsl
+import copy
+import glob
+import itertools
+import json
 import numpy as np
 import multiprocessing as mp
-from collections import namedtuple
+import os
+import sqlite3
+import time
+from collections import deque, namedtuple, OrderedDict
+
+# the generator a pool worker process uses, set once by initWorker
+workerGenerator = None
+
+def initWorker(generator):
+    global workerGenerator
+    workerGenerator = generator
+
+# the output file text for a chunk of programs, worked out in a pool worker,
+# and what the chunk added to the worker's z3Stats, for the parent to add to its own
+def formatExamplesChunk(progStrings):
+    before = dict(workerGenerator.z3Stats)
+    text = ''.join(workerGenerator.getExampleBlock(progString) for progString in progStrings)
+    return text, {k: v - before[k] for k, v in workerGenerator.z3Stats.items()}
+
+# shard file a pool worker writes to in runSharded, opened on its first chunk
+workerShard = None
+
+# writes the text for a chunk of programs to this worker's own shard file
+# and returns where it went as a manifest line: chunk position in the program source, shard file, byte offset and length,
+# along with the chunk's z3Stats as formatExamplesChunk gives them
+def writeExamplesChunk(task):
+    global workerShard
+    chunkIndex, progStrings = task
+    if workerShard is None:
+        workerShard = open(workerGenerator.output_file_name+'.shard'+str(os.getpid()), 'ab')
+    text, stats = formatExamplesChunk(progStrings)
+    block = text.encode('utf-8')
+    offset = workerShard.tell()
+    workerShard.write(block)
+    workerShard.flush()
+    return '\t'.join([str(chunkIndex), workerShard.name, str(offset), str(len(block))])+'\n', stats
+
+# lists of up to size items from any iterable
+def chunks(items, size):
+    items = iter(items)
+    chunk = list(itertools.islice(items, size))
+    while chunk:
+        yield chunk
+        chunk = list(itertools.islice(items, size))
+
+# programs for an IO generator, taken lazily from a file of program strings (one per line) or from any iterable
+# yields (position, program string), where position is where a run can start from to pick up after that program:
+# a byte offset into the file, or a count of programs for other iterables
+class ProgramSource:
+    def __init__(self, programs, start = 0):
+        self.programs = programs
+        self.start = start
+
+    def __iter__(self):
+        if isinstance(self.programs, str):
+            with open(self.programs, 'rb') as f:
+                f.seek(self.start)
+                position = self.start
+                for line in f:
+                    position += len(line)
+                    if line.strip():
+                        yield position, line.decode('utf-8')
+        else:
+            for position, progString in enumerate(itertools.islice(self.programs, self.start, None), self.start+1):
+                yield position, progString
+
+# where a run had got to, as (source position, size of the file the parent writes), or None
+def readProgress(fileName):
+    if not os.path.exists(fileName):
+        return None
+    with open(fileName, 'r', encoding='utf-8') as f:
+        position, size = f.read().split()
+    return int(position), int(size)
+
+# replaces the file in one step, so a run killed part way through leaves the last progress it saved
+def writeProgress(fileName, position, size):
+    with open(fileName+'.tmp', 'w', encoding='utf-8') as f:
+        f.write(str(position)+'\t'+str(size)+'\n')
+    os.replace(fileName+'.tmp', fileName)
+
+# for when a run completes, so a later resume doesn't pick up from a finished run
+def removeProgress(fileName):
+    if os.path.exists(fileName):
+        os.remove(fileName)
+
+# z3 oracles with a program already encoded (including the inputsNotNone and distinctInandOut constraints)
+# kept per process, least recently used dropped first, so a pool worker that meets a program again skips encoding it.
+# getExamplesfromZ3 only adds constraints between beginAddConstraints and removeAddedConstraints,
+# so an oracle is back in the same state once it's done with
+class OraclePool:
+    def __init__(self, maxSize = 64):
+        self.maxSize = maxSize
+        self.oracles = OrderedDict()
+
+    # (oracle, whether it was already encoded)
+    # copies above 1 gives a z3ExampleSetOracle with distinct outputs, which times out after timeout ms
+    def get(self, max_list_length, numberOfInputs, intInputs, programLines, mode, valueBits = 32, lengthBits = None, copies = 1, timeout = None, incremental = False):
+        key = (max_list_length, numberOfInputs, tuple(intInputs), tuple(programLines), mode, valueBits, lengthBits, copies, incremental)
+        oracle = self.oracles.get(key)
+        if oracle is not None:
+            self.oracles.move_to_end(key)
+            return oracle, True
+        if copies > 1:
+            oracle = z3InputsOracle.z3ExampleSetOracle(max_list_length, copies, timeout, valueBits = valueBits, lengthBits = lengthBits, incremental = incremental)
+        elif mode == 'basic':
+            oracle = z3InputsOracle.z3InputsOracle(max_list_length, valueBits = valueBits, lengthBits = lengthBits, incremental = incremental)
+        else:
+            oracle = z3InputsOracle.z3InputsOracle(max_list_length, timeout=1000, valueBits = valueBits, lengthBits = lengthBits, incremental = incremental)
+        oracle.setProgram(numberOfInputs, intInputs, programLines, mode)
+        oracle.inputsNotNone()
+        oracle.distinctInandOut()
+        if copies > 1:
+            oracle.distinctOutputs()
+            oracle.distinctInputs()
+        self.oracles[key] = oracle
+        if len(self.oracles) > self.maxSize:
+            self.oracles.popitem(last = False)
+        return oracle, False
+
+oraclePool = OraclePool()
+
+# how often each optional constraint getExamplesfromZ3 puts on a z3 query (see z3BaseOracle.addOptional) had to be dropped,
+# counted against every DSL function in the program, so ones that are next to never satisfiable for some function
+# can be left out upfront. counts are kept per process, or in a sqlite file shared by workers and later runs if one is given
+class SpecStats:
+    def __init__(self, minTries = 20, skipRate = 0.9):
+        self.minTries = minTries
+        self.skipRate = skipRate
+        # (function, name): [tried, dropped]
+        self.counts = {}
+        # open sqlite files by name, each process opens its own
+        self.stores = {}
+        self.storesPid = os.getpid()
+
+    def getStore(self, fileName):
+        if self.storesPid != os.getpid():
+            self.stores = {}
+            self.storesPid = os.getpid()
+        db = self.stores.get(fileName)
+        if db is None:
+            db = sqlite3.connect(fileName, timeout = 60, isolation_level = None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.execute('CREATE TABLE IF NOT EXISTS specs (function TEXT, name TEXT, tried INTEGER, dropped INTEGER, PRIMARY KEY (function, name))')
+            self.stores[fileName] = db
+        return db
+
+    # specCounts is {name: [tried, dropped]} for one program
+    def record(self, functions, specCounts, fileName = None):
+        rows = [(f, name, tried, dropped) for f in functions for name, (tried, dropped) in specCounts.items()]
+        if fileName is not None:
+            self.getStore(fileName).executemany('INSERT INTO specs VALUES (?, ?, ?, ?) ON CONFLICT (function, name) DO UPDATE SET tried = tried + excluded.tried, dropped = dropped + excluded.dropped', rows)
+            return
+        for f, name, tried, dropped in rows:
+            counts = self.counts.setdefault((f, name), [0, 0])
+            counts[0] += tried
+            counts[1] += dropped
+
+    # {(function, name): (tried, dropped)}
+    def getCounts(self, fileName = None):
+        if fileName is not None:
+            return {(f, name): (tried, dropped) for f, name, tried, dropped in self.getStore(fileName).execute('SELECT * FROM specs')}
+        return {key: tuple(c) for key, c in self.counts.items()}
+
+    # names of the optional constraints to leave out for a program with these functions
+    def getSkipped(self, functions, fileName = None):
+        if fileName is not None:
+            functions = list(functions)
+            rows = self.getStore(fileName).execute('SELECT name, tried, dropped FROM specs WHERE function IN ('+','.join('?'*len(functions))+')', functions)
+        else:
+            rows = [(name, tried, dropped) for (f, name), (tried, dropped) in self.counts.items() if f in functions]
+        return set(name for name, tried, dropped in rows if tried >= self.minTries and dropped >= self.skipRate*tried)
+
+specStats = SpecStats()
 
 class exampleGenerator:
     def factory(self, mode, output_file_name, program_list, number_per_program = 25, max_list_length = 10, examples_per_set = 5):
@@ -17,26 +194,135 @@ class exampleGenerator:
             return IOGeneratorVaried(output_file_name, program_list, number_per_program, max_list_length, examples_per_set)
 
 class IOGeneratorBase():
+    # most candidate inputs the sampling generators check in one round
+    candidateBatchSize = 32
+    # bit-vector widths of the z3 oracle's values and list lengths, see z3InputsOracle (oracleBenchmark.py compares them)
+    z3ValueBits = 32
+    z3LengthBits = None
+    # with z3ExampleSets, getExamplesfromZ3 without specifications first asks for each set of examples_per_set examples in one query,
+    # on that many copies of the program, going back to an example at a time if it's unsat or takes over z3ExampleSetTimeout ms.
+    # off by default as z3 takes longer over k copies than over k separate queries, see oracleBenchmark.py
+    z3ExampleSets = False
+    z3ExampleSetTimeout = 5000
+    # sqlite file to keep SpecStats counts in across runs
+    specStatsFile = None
+    # z3 oracles in incremental mode, see z3InputsOracle
+    z3Incremental = False
+
     def __init__(self, output_file_name, program_list, number_per_program, max_list_length, examples_per_set):
         self.output_file_name = output_file_name
         self.program_list = program_list
         self.number_per_program = number_per_program
         self.max_list_length = max_list_length
         self.examples_per_set = examples_per_set
+        # z3 programs encoded, how many of those came ready encoded from oraclePool, and seconds spent encoding,
+        # and how many example set queries were satisfied and how many had to go back to an example at a time
+        self.z3Stats = {'programs': 0, 'reused': 0, 'encodeTime': 0.0, 'exampleSets': 0, 'exampleSetFallbacks': 0}
+
+    # adds z3Stats counted elsewhere, e.g. by a pool worker in run or runSharded, to this generator's
+    def addZ3Stats(self, stats):
+        for k, v in stats.items():
+            self.z3Stats[k] += v
+
+    # n_workers defaults to the number of cpus, chunk_size is how many programs go to a worker at a time
+    # and maxtasksperchild (chunks per worker process) is passed on to the pool
+    # program_list is read lazily, with at most max_in_flight chunks (default 4 per worker) handed out at once,
+    # and output is written in program order. with resumable (or resume) set, the position reached in program_list
+    # is saved to output_file_name.progress after each chunk, and the file is removed once the run completes.
+    # resume picks up from a saved position (program_list must give the same programs again)
+    def run(self, n_workers = None, chunk_size = 16, maxtasksperchild = None, max_in_flight = None, resume = False, resumable = False):
+        progressFileName = self.output_file_name+'.progress'
+        progress = readProgress(progressFileName) if resume else None
+        start = 0
+        with open(self.output_file_name, 'ab') as outFile:
+            if progress is not None:
+                # drop anything written after the last saved progress
+                start = progress[0]
+                outFile.truncate(progress[1])
+            for position, (block, stats) in self.iterChunks(formatExamplesChunk, n_workers, chunk_size, maxtasksperchild, max_in_flight, start, False):
+                self.addZ3Stats(stats)
+                outFile.write(block.encode('utf-8'))
+                outFile.flush()
+                if resumable or resume:
+                    writeProgress(progressFileName, position, outFile.tell())
+        removeProgress(progressFileName)
+
+    # as run, but each worker writes straight to its own shard file and the parent only records where each chunk went,
+    # in output_file_name.manifest. mergeShards then adds the shards to the output file
+    # shards left by an earlier run are removed first, unless resuming from it
+    def runSharded(self, n_workers = None, chunk_size = 16, maxtasksperchild = None, keepShards = False, max_in_flight = None, resume = False, resumable = False):
+        progressFileName = self.output_file_name+'.progress'
+        progress = readProgress(progressFileName) if resume else None
+        if progress is None:
+            for shard in self.shardFiles():
+                os.remove(shard)
+        start = 0
+        with open(self.output_file_name+'.manifest', 'ab' if progress is not None else 'wb') as manifest:
+            if progress is not None:
+                start = progress[0]
+                manifest.truncate(progress[1])
+            for position, (entry, stats) in self.iterChunks(writeExamplesChunk, n_workers, chunk_size, maxtasksperchild, max_in_flight, start, True):
+                self.addZ3Stats(stats)
+                manifest.write(entry.encode('utf-8'))
+                manifest.flush()
+                if resumable or resume:
+                    writeProgress(progressFileName, position, manifest.tell())
+        self.mergeShards(keepShards)
+        removeProgress(progressFileName)
 
-    def run(self):
-        n_cpus = mp.cpu_count()
-        pool = mp.Pool(processes = n_cpus)
-        with open(self.output_file_name, 'a', encoding='utf-8') as outFile:
-            for program, listOfExamples in pool.imap_unordered(self.getFormattedExamples, self.program_list):
-                for j in range(0, self.number_per_program, self.examples_per_set):
-                    outFile.write(program)
-                    count_examples = 0
-                    for ex in listOfExamples[j:j+self.examples_per_set]:
-                        count_examples += 1
-                        outFile.write(ex)
-                    for defecit in range(self.examples_per_set - count_examples):
-                        outFile.write('Could not find Example\n')
+    # results of task for each chunk of programs from start, in order, as (source position after the chunk, result)
+    # chunks are only read from program_list as earlier ones finish, so memory stays bounded however many programs there are
+    # withPosition passes task (position, program strings) rather than just the program strings
+    def iterChunks(self, task, n_workers, chunk_size, maxtasksperchild, max_in_flight, start, withPosition):
+        if n_workers is None:
+            n_workers = mp.cpu_count()
+        if max_in_flight is None:
+            max_in_flight = 4*n_workers
+        # workers get a copy of this generator once, without the program list, rather than with every task
+        workerCopy = copy.copy(self)
+        workerCopy.program_list = None
+        pending = deque()
+        with mp.Pool(processes = n_workers, initializer = initWorker, initargs = (workerCopy,), maxtasksperchild = maxtasksperchild) as pool:
+            for chunk in chunks(ProgramSource(self.program_list, start), chunk_size):
+                position = chunk[-1][0]
+                progStrings = [progString for __, progString in chunk]
+                args = (position, progStrings) if withPosition else progStrings
+                pending.append((position, pool.apply_async(task, (args,))))
+                if len(pending) >= max_in_flight:
+                    position, result = pending.popleft()
+                    yield position, result.get()
+            while pending:
+                position, result = pending.popleft()
+                yield position, result.get()
+
+    # shard files the workers of a runSharded for this output file have written
+    def shardFiles(self):
+        return glob.glob(glob.escape(self.output_file_name)+'.shard*')
+
+    # appends the chunks listed in the manifest to the output file, in the order they're listed (program_list order)
+    # then removes the manifest and all the shard files, including any a killed run left that the manifest doesn't use,
+    # unless keepShards is set
+    def mergeShards(self, keepShards = False):
+        manifestFileName = self.output_file_name+'.manifest'
+        with open(manifestFileName, 'r', encoding='utf-8') as manifest:
+            entries = [l.rstrip('\n').split('\t') for l in manifest]
+        entries = [(int(chunkIndex), shard, int(offset), int(length)) for chunkIndex, shard, offset, length in entries]
+        shards = {}
+        try:
+            with open(self.output_file_name, 'ab') as outFile:
+                for chunkIndex, shard, offset, length in entries:
+                    if shard not in shards:
+                        shards[shard] = open(shard, 'rb')
+                    f = shards[shard]
+                    f.seek(offset)
+                    outFile.write(f.read(length))
+        finally:
+            for f in shards.values():
+                f.close()
+        if not keepShards:
+            for shard in self.shardFiles():
+                os.remove(shard)
+            os.remove(manifestFileName)
 
     def getFormattedExamples(self, progString):
         program = dsl.Program.fromString(progString)
@@ -46,6 +332,20 @@ class IOGeneratorBase():
             exampleSetStrings.append(program.generateInputString(ex[0])+'|'+str(ex[1])+'\n')
         return progString, exampleSetStrings
 
+    # the output file text for one program, with the program repeated before each set of examples
+    def getExampleBlock(self, progString):
+        program, listOfExamples = self.getFormattedExamples(progString)
+        block = []
+        for j in range(0, self.number_per_program, self.examples_per_set):
+            block.append(program)
+            count_examples = 0
+            for ex in listOfExamples[j:j+self.examples_per_set]:
+                count_examples += 1
+                block.append(ex)
+            for defecit in range(self.examples_per_set - count_examples):
+                block.append('Could not find Example\n')
+        return ''.join(block)
+
     def outIsSuitable(self, out, tries):
         if type(out) is int:
             if out == 0 and tries >= int(self.patience*0.9):
@@ -59,6 +359,51 @@ class IOGeneratorBase():
             return True
         return False
 
+    # outIsSuitable over a batch of checked outputs, tries gives the try number of each row
+    def outIsSuitableMany(self, outputType, accepted, outputs, tries):
+        late = tries >= int(self.patience*0.9)
+        if outputType is int:
+            values = outputs.values[:, 0]
+            return accepted & (outputs.lengths > 0) & (values >= -255) & (values < 256)
+        return accepted & ((outputs.lengths > 0) | late)
+
+    # rounds double in size up to candidateBatchSize, so easy programs don't pay for candidates they never look at
+    def candidateRoundSize(self, tries):
+        return min(self.candidateBatchSize, max(1, tries))
+
+    # one candidate from a round, as the python lists and ints the rest of the code expects
+    def candidateInputs(self, program, inputBatches, j):
+        allInputs = []
+        for progIn, b in zip(program.inputs, inputBatches):
+            value = b.getValue(j, progIn.type)
+            allInputs.append(list(value) if progIn.type is list else value)
+        return allInputs
+
+    # checks a round of candidates (one ListBatch per program input)
+    # returns the index, inputs and output of the first suitable candidate (or Nones)
+    # plus the mask of candidates that passed the range checks
+    def firstSuitable(self, program, runWithChecks, inputBatches, candidateTries):
+        if len(candidateTries) == 1:
+            # a lone candidate is cheaper through the compiled program than through the batch executor
+            allInputs = self.candidateInputs(program, inputBatches, 0)
+            out = runWithChecks(allInputs, False)
+            accepted = np.array([out is not False])
+            if isinstance(out, tuple):
+                out = list(out)
+            if self.outIsSuitable(out, candidateTries[0]):
+                return 0, allInputs, out, accepted
+            return None, None, None, accepted
+        outputType = program.getOutputType()
+        accepted, outputs = program.runWithChecksBatch(inputBatches, False)
+        suitable = self.outIsSuitableMany(outputType, accepted, outputs, np.asarray(candidateTries))
+        if not suitable.any():
+            return None, None, None, accepted
+        j = int(np.argmax(suitable))
+        out = outputs.getValue(j, outputType)
+        if isinstance(out, tuple):
+            out = list(out)
+        return j, self.candidateInputs(program, inputBatches, j), out, accepted
+
     def getExamplesfromZ3(self, program, required, exclude_set = [], specifications = [], returnNullResults = False):
         resultSet = []
         noRepeatedIn = True
@@ -66,29 +411,52 @@ class IOGeneratorBase():
 
         codifiedProgram = []
         for l in program.lines:
-            thisLine = (l.function, l.option)+tuple(l.inputRefs)
+            thisLine = (l.opcode,)+tuple(l.inputRefs)
             if len(l.inputRefs) == 1:
                 thisLine += (None,)
             codifiedProgram.append(thisLine)
 
         integerInputIndices = [i for i in range(len(program.inputs)) if program.inputs[i].type is int]
 
-        if specifications == []:
-            z3interface = z3InputsOracle.z3InputsOracle(self.max_list_length)
-            z3interface.setProgram(len(program.inputs), integerInputIndices, codifiedProgram, 'basic')
-        else:
-            z3interface = z3InputsOracle.z3InputsOracle(self.max_list_length, timeout=1000)
-            z3interface.setProgram(len(program.inputs), integerInputIndices, codifiedProgram, 'varied')
+        self.z3Stats['programs'] += 1
+        # the oracle for an example at a time, only encoded once it's needed
+        z3interface = None
+
+        exampleSets = self.z3ExampleSets and specifications == [] and self.examples_per_set > 1
+        if exampleSets:
+            startTime = time.time()
+            setOracle, reused = oraclePool.get(self.max_list_length, len(program.inputs), integerInputIndices, codifiedProgram, 'basic', self.z3ValueBits, self.z3LengthBits, self.examples_per_set, self.z3ExampleSetTimeout, self.z3Incremental)
+            self.z3Stats['reused'] += reused
+            self.z3Stats['encodeTime'] += time.time() - startTime
 
-        z3interface.inputsNotNone()
-        z3interface.distinctInandOut()
+        programFunctions = set(dsl.components.registry.keys[l.opcode] for l in program.lines)
+        skippedSpecs = specStats.getSkipped(programFunctions, self.specStatsFile)
+        # optional constraint name: [queries it was in, queries it was dropped from]
+        specCounts = {}
 
         failedExclusions = set()
         failedFeatures = set()
-        for example_num in range(required):
+        example_num = 0
+        while example_num < required:
+            if exampleSets and example_num % self.examples_per_set == 0 and required - example_num >= self.examples_per_set:
+                exampleSet = self.getExampleSetfromZ3(program, setOracle, exclude_set[example_num:example_num + self.examples_per_set])
+                if exampleSet is not None:
+                    self.z3Stats['exampleSets'] += 1
+                    resultSet.extend(exampleSet)
+                    example_num += self.examples_per_set
+                    continue
+                # a program that can't give one set is unlikely to give the next
+                self.z3Stats['exampleSetFallbacks'] += 1
+                exampleSets = False
+
+            if z3interface is None:
+                startTime = time.time()
+                z3interface, reused = oraclePool.get(self.max_list_length, len(program.inputs), integerInputIndices, codifiedProgram, 'basic' if specifications == [] else 'varied', self.z3ValueBits, self.z3LengthBits, incremental = self.z3Incremental)
+                self.z3Stats['reused'] += reused
+                self.z3Stats['encodeTime'] += time.time() - startTime
+
             # any additional constraints to be used?
-            try: spec = specifications[i]
-            except: spec = None
+            spec = specifications[example_num] if example_num < len(specifications) else None
 
             z3interface.beginAddConstraints()
 
@@ -112,372 +480,502 @@ class IOGeneratorBase():
             I = [x[0] for x in R if x is not None]
             recentInputs = [y for x in I for y in x]
             recentOutputs = [x[1] for x in R if x is not None]
-            if noRepeatedIn:
+            # everything from here on is optional, named so the oracle can drop whichever are in an unsat core
+            # rather than the query failing. names specStats says almost never work for this program's functions are left out
+            if noRepeatedIn and 'noRepeatedIn' not in skippedSpecs:
                 for val in recentInputs:
-                    z3interface.excludeInputConstraint(val)
-            if noRepeatedOut:
+                    z3interface.excludeInputs(val, 'noRepeatedIn')
+            if noRepeatedOut and 'noRepeatedOut' not in skippedSpecs:
                 for val in recentOutputs:
-                    z3interface.excludeOutputs(val)
+                    z3interface.excludeOutputs(val, 'noRepeatedOut')
 
-            if spec and spec.notNull: z3interface.excludeNullBehaviours()
+            if spec and spec.notNull and 'notNull' not in skippedSpecs: z3interface.excludeNullBehaviours('notNull')
 
-            if spec and spec.behaviours and spec.behaviours not in failedExclusions:
-                z3interface.excludeBehaviours(spec.behaviours)
+            if spec and spec.behaviours and spec.behaviours not in failedExclusions and 'behaviours' not in skippedSpecs:
+                z3interface.excludeBehaviours(spec.behaviours, 'behaviours')
 
-            if spec and spec.updateFeature not in failedFeatures:
+            if spec and spec.updateFeature not in failedFeatures and spec.updateFeature not in skippedSpecs:
                 if spec.updateFeature == "min":
-                    z3interface.setOutMin(-50)
+                    z3interface.setOutMin(-50, 'min')
                 if spec.updateFeature == "max":
-                    z3interface.setOutMax(50)
+                    z3interface.setOutMax(50, 'max')
                 if spec.updateFeature == "len":
-                    z3interface.setOutputMinimumLength(4)
+                    z3interface.setOutputMinimumLength(4, 'len')
 
+            tried = list(z3interface.optionals)
             res = z3interface.evalSatAndUpdateModel().removeAddedConstraints().getLastInputsAndOutputs()
 
+            # what had to be dropped isn't tried again for this program
+            for name in tried:
+                counts = specCounts.setdefault(name, [0, 0])
+                counts[0] += 1
+                if name in z3interface.droppedOptionals:
+                    counts[1] += 1
+                    if name == 'noRepeatedIn': noRepeatedIn = False
+                    elif name == 'noRepeatedOut': noRepeatedOut = False
+                    elif name == 'behaviours': failedExclusions = failedExclusions | {spec.behaviours}
+                    elif name in ['min', 'max', 'len']: failedFeatures = failedFeatures | {spec.updateFeature}
+
             if res is None:
                 # this is useful when calling code wants to know which queries were successful
                 if returnNullResults: resultSet.append(res)
-                # not able to find IO example - relax conditions so don't try a bad query again
+                # not able to find IO example, with no unsat core to go on - relax conditions so don't try a bad query again
                 if spec and spec.behaviours: failedExclusions = failedExclusions | {spec.behaviours}
                 if spec and spec.updateFeature: failedFeatures = failedFeatures | {spec.updateFeature}
+                for name in ['behaviours', spec and spec.updateFeature]:
+                    if name in tried and name not in z3interface.droppedOptionals:
+                        specCounts[name][1] += 1
                 if not spec:
                     if noRepeatedOut: noRepeatedOut = False
                     else: noRepeatedIn = False
             else:
-                allInputs = res[1:][::-1]
-                for i, progIn in enumerate(program.inputs):
-                    if progIn.type is int:
-                        if allInputs[i] == []: allInputs[i] = None
-                        else: allInputs[i] = allInputs[i][0]
-                if program.getOutputType() is int:
-                    if not res[0]: out = None
-                    else: out = res[0][0]
-                else: out = res[0]
-                resultSet.append((allInputs, out))
+                resultSet.append(self.z3ResultToExample(program, res))
+            example_num += 1
 
+        specStats.record(programFunctions, specCounts, self.specStatsFile)
         return resultSet
 
-class IOGeneratorRestrictedDomain(IOGeneratorBase):
-    def backPropagateValues(self, program, listLength):
-        bounds = [None] * (len(program.lines)+2)
-        # initiate program output bounds i.e. output of final line
-        bounds[len(program.lines)-1] = (-255,256)
-        # loop starts at final line and works backwards thru program
-        for index in reversed(range(len(program.lines))):
-            lineOutputBound = bounds[index]
-            assert(lineOutputBound is not None)
-            programLine = program.lines[index]
-            func = programLine.function
-            opt = programLine.option
-            lineInputs = programLine.inputRefs
-            if func in ['HEAD', 'LAST']:
-                existingBound = bounds[lineInputs[0]]
-                if existingBound:
-                    bounds[lineInputs[0]] = (max(existingBound[0], lineOutputBound[0]), min(existingBound[1], lineOutputBound[1]))
-                else:
-                    bounds[lineInputs[0]] = lineOutputBound
-            elif func in ['TAKE', 'DROP', 'ACCESS']:
-                existingBoundInt = bounds[lineInputs[0]]
-                existingBoundList = bounds[lineInputs[1]]
-                if existingBoundInt:
-                    pass
-                else:
-                    bounds[lineInputs[0]] = (-255, 256)
-                if existingBoundList:
-                    bounds[lineInputs[1]] = (max(existingBoundList[0], lineOutputBound[0]), min(existingBoundList[1], lineOutputBound[1]))
-                else:
-                    bounds[lineInputs[1]] = lineOutputBound
-            elif func in ['MAXIMUM', 'MINIMUM', 'SORT', 'REVERSE']:
-                existingBound = bounds[lineInputs[0]]
-                if existingBound:
-                    bounds[lineInputs[0]] = (max(existingBound[0], lineOutputBound[0]), min(existingBound[1], lineOutputBound[1]))
-                else:
-                    bounds[lineInputs[0]] = lineOutputBound
-            elif func == 'FILTER':
-                if opt == '<0':
-                    lb = 0
-                    ub = 256
-                    if lineOutputBound[0] < 0: lb = lineOutputBound[0]
-                    if lineOutputBound[1] < 0: ub = lineOutputBound[1]
-                    existingBound = bounds[lineInputs[0]]
-                    if existingBound:
-                        bounds[lineInputs[0]] = (max(existingBound[0],lb), min(existingBound[1],ub))
-                    else:
-                        bounds[lineInputs[0]] = (lb, ub)
-                elif opt == '>0':
-                    lb = -255
-                    ub = 0
-                    if lineOutputBound[0] > 0: lb = lineOutputBound[0]
-                    if lineOutputBound[1] > 0: ub = lineOutputBound[1]
-                    existingBound = bounds[lineInputs[0]]
-                    if existingBound:
-                        bounds[lineInputs[0]] = (max(existingBound[0],lb), min(existingBound[1],ub))
-                    else:
-                        bounds[lineInputs[0]] = (lb, ub)
-                elif opt in ['%2==0', '%2==1']:
-                    try:
-                        existingBound = bounds[lineInputs[0]]
-                        bounds[lineInputs[0]] = (max(existingBound[0], lineOutputBound[0]), min(existingBound[1], lineOutputBound[1]))
-                    except:
-                        bounds[lineInputs[0]] = lineOutputBound
-            elif func == 'COUNT':
-                # this one's tricky
-                # the length of input matters, not the range
-                existingBound = bounds[lineInputs[0]]
-                if existingBound: pass
-                else: bounds[lineInputs[0]] = (-255, 256)
-            elif func == 'SUM':
-                lb = int(np.ceil(lineOutputBound[0] / listLength))
-                ub = int(np.floor(lineOutputBound[1] / listLength))
-                existingBound = bounds[lineInputs[0]]
-                if existingBound:
-                    bounds[lineInputs[0]] = (max(existingBound[0], lb), min(existingBound[1], ub))
-                else:
-                    bounds[lineInputs[0]] = (lb, ub)
-            elif func == 'MAP':
-                if opt == '+1':
-                    lb = max(lineOutputBound[0]-1, -255)
-                    ub = min(lineOutputBound[1]-1, 256)
-                elif opt == '-1':
-                    lb = max(lineOutputBound[0]+1, -255)
-                    ub = min(lineOutputBound[1]+1, 256)
-                elif opt == '/2':
-                    lb = max(lineOutputBound[0]*2, -255)
-                    ub = min(lineOutputBound[1]*2, 256)
-                elif opt == '*2':
-                    if lineOutputBound[0] < 0:
-                        lb = (lineOutputBound[0]//2)+1
-                    else:
-                        lb = (lineOutputBound[0]//2)
-                    if lineOutputBound[1] < 0:
-                        ub = (lineOutputBound[1]//2)+1
-                    else:
-                        ub = lineOutputBound[1]//2
-                elif opt == '/3':
-                    lb = max(lineOutputBound[0]*3, -255)
-                    ub = min(lineOutputBound[1]*3, 256)
-                elif opt == '*3':
-                    if lineOutputBound[0] < 0:
-                        lb = (lineOutputBound[0]//3)+1
-                    else:
-                        lb = (lineOutputBound[0]//3)
-                    if lineOutputBound[1] < 0:
-                        ub = (lineOutputBound[1]//3)+1
-                    else:
-                        ub = lineOutputBound[1]//3
-                elif opt == '/4':
-                    lb = max(lineOutputBound[0]*4, -255)
-                    ub = min(lineOutputBound[1]*4, 256)
-                elif opt == '*4':
-                    if lineOutputBound[0] < 0:
-                        lb = (lineOutputBound[0]//4)+1
-                    else:
-                        lb = (lineOutputBound[0]//4)
-                    if lineOutputBound[1] < 0:
-                        ub = (lineOutputBound[1]//4)+1
-                    else:
-                        ub = lineOutputBound[1]//4
-                elif opt == '**2':
-                    if lineOutputBound[1] < 0:
-                        # impossible, so give empty range
-                        lb = 1
-                        ub = 0
-                    else:
-                        ub = int(np.sqrt(lineOutputBound[1]))
-                        lb = -ub
-                        if lineOutputBound[0] > 0:
-                            # e.g. output at least 4, although -2 is fine, -1, 0 and 1 are not
-                            # so have to take lower bound as +2
-                            lb = int(np.ceil(np.sqrt(lineOutputBound[0])))
-                elif opt == '*(-1)':
-                    lb = -lineOutputBound[1]
-                    ub = -lineOutputBound[0]
-                existingBound = bounds[lineInputs[0]]
-                if existingBound:
-                    bounds[lineInputs[0]] = (max(existingBound[0], lb), min(existingBound[1], ub))
+    # examples_per_set examples from one query on setOracle, each with the same constraints getExamplesfromZ3 puts on
+    # a query without specifications, or None if that's unsat or times out
+    # excluded holds one example whose inputs and output each copy must avoid, as exclude_set does in getExamplesfromZ3
+    def getExampleSetfromZ3(self, program, setOracle, excluded):
+        setOracle.beginAddConstraints()
+        for c, copy in enumerate(setOracle.copies):
+            random_lengths = {}
+            for i, in_data in enumerate(program.inputs):
+                if in_data.type == list:
+                    random_lengths[-(i+1)] = np.random.randint(1, self.max_list_length//2 + 1)
                 else:
-                    bounds[lineInputs[0]] = (lb, ub)
-            elif func == 'ZIPWITH':
-                if opt == '+':
-                    lb = int(lineOutputBound[0]/2)
-                    ub = int(lineOutputBound[1]/2)
-                    if lineOutputBound[0] > 0:
-                        lb = int(np.ceil(lineOutputBound[0]/2))
-                    if lineOutputBound[1] < 0:
-                        ub = int(np.floor(lineOutputBound[0]/2))
-                elif opt == '-':
-                    if lineOutputBound[0] > 0 or lineOutputBound[1] < 0:
-                        # no safe range
-                        lb = 1
-                        ub = 0
-                    else:
-                        val = int(min(abs(lineOutputBound[0]), lineOutputBound[1])/2)
-                        lb = -val
-                        ub = val
-                elif opt == '*':
-                    if lineOutputBound[1] < 0:
-                        # no safe range
-                        lb = 1
-                        ub = 0
-                    else:
-                        upper = int(np.sqrt(lineOutputBound[1]))
-                        lower = int(np.ceil(np.sqrt(abs(lineOutputBound[0]))))
-                        val = min(upper, lower)
-                        lb = -val
-                        ub = val
-                elif opt in ['MAX', 'MIN']:
-                    lb = lineOutputBound[0]
-                    ub = lineOutputBound[1]
-                bounds[lineInputs[0]] = (lb, ub)
-                bounds[lineInputs[1]] = (lb, ub)
-                existingBound1 = bounds[lineInputs[0]]
-                existingBound2 = bounds[lineInputs[1]]
-                if existingBound1:
-                    bounds[lineInputs[0]] = (max(existingBound1[0], lb), min(existingBound1[1], ub))
-                if existingBound2:
-                    bounds[lineInputs[1]] = (max(existingBound2[0], lb), min(existingBound2[1], ub))
-            elif func == 'SCANL1':
-                if opt == '*':
-                    if lineOutputBound[1] < 0:
-                        # no safe range
-                        lb = 1
-                        ub = 0
-                    else:
-                        absbound = min(abs(lineOutputBound[0]), lineOutputBound[1])
-                        val = int(absbound**(1/float(listLength)))
-                        lb = -val
-                        ub = val
-                elif opt == '+':
-                    if lineOutputBound[0] <= 0:
-                        lb = int(lineOutputBound[0]/listLength)
-                    else:
-                        lb = int(np.ceil(lineOutputBound[0]/listLength))
-                    if lineOutputBound[1] >= 0:
-                        ub = int(lineOutputBound[1]/listLength)
-                    else:
-                        ub = int(np.floor(lineOutputBound[1]/listLength))
-                elif opt == '-':
-                    if lineOutputBound[0] > 0 or lineOutputBound[1] < 0:
-                        # no safe range
-                        lb = 1
-                        ub = 0
-                    else:
-                        val = int(min(abs(lineOutputBound[0]), lineOutputBound[1])/listLength)
-                        lb = -val
-                        ub = val
-                elif opt in ['MAX', 'MIN']:
-                    lb = lineOutputBound[0]
-                    ub = lineOutputBound[1]
-                try:
-                    existingBound = bounds[lineInputs[0]]
-                    bounds[lineInputs[0]] = (max(existingBound[0], lb), min(existingBound[1], ub))
-                except: bounds[lineInputs[0]] = (lb, ub)
+                    random_lengths[-(i+1)] = 0
+            copy.setInputMinimumLengths(random_lengths)
+            if program.getOutputType() is int:
+                copy.outputNotNone()
+            if c < len(excluded) and excluded[c] is not None:
+                for val in excluded[c][0]:
+                    copy.excludeInputs(val)
+                copy.excludeOutputs(excluded[c][1])
+        results = setOracle.evalSatAndUpdateModel().removeAddedConstraints().getLastExamples()
+        if results is None:
+            return None
+        return [self.z3ResultToExample(program, res) for res in results]
+
+    # an oracle's [output, inputs last to first] as (inputs, output), with empty int values as None
+    def z3ResultToExample(self, program, res):
+        allInputs = res[1:][::-1]
+        for i, progIn in enumerate(program.inputs):
+            if progIn.type is int:
+                if allInputs[i] == []: allInputs[i] = None
+                else: allInputs[i] = allInputs[i][0]
+        if program.getOutputType() is int:
+            if not res[0]: out = None
+            else: out = res[0][0]
+        else: out = res[0]
+        return (allInputs, out)
 
+# interval analysis for IOGeneratorRestrictedDomain
+# works back from the program output's range to a range for each program input that keeps every line in range.
+# bounds are (lower, upper) arrays with one entry per list length, so all lengths are analysed in one pass
+
+def sameBounds(lb, ub, lengths):
+    return lb, ub
+
+def anyValue(lb, ub, lengths):
+    return np.full(len(lengths), -255), np.full(len(lengths), 256)
+
+def noBounds(lb, ub, cond):
+    # (1, 0) is an empty range, for outputs no input can give
+    return np.where(cond, 1, lb), np.where(cond, 0, ub)
+
+# int(a/b), which rounds towards zero
+def truncDiv(a, b):
+    return np.trunc(a/b).astype(np.int64)
+
+def ceilDiv(a, b):
+    return np.ceil(a/b).astype(np.int64)
+
+def floorDiv(a, b):
+    return np.floor(a/b).astype(np.int64)
+
+def isqrt(a):
+    return np.sqrt(np.maximum(a, 0)).astype(np.int64)
+
+def filterNegative(lb, ub, lengths):
+    return np.where(lb < 0, lb, 0), np.where(ub < 0, ub, 256)
+
+def filterPositive(lb, ub, lengths):
+    return np.where(lb > 0, lb, -255), np.where(ub > 0, ub, 0)
+
+def sumBounds(lb, ub, lengths):
+    return ceilDiv(lb, lengths), floorDiv(ub, lengths)
+
+def mapAdd(k):
+    return lambda lb, ub, lengths: (np.maximum(lb-k, -255), np.minimum(ub-k, 256))
+
+def mapDivide(k):
+    return lambda lb, ub, lengths: (np.maximum(lb*k, -255), np.minimum(ub*k, 256))
+
+def mapMultiply(k):
+    return lambda lb, ub, lengths: (lb//k + (lb < 0), ub//k + (ub < 0))
+
+def mapSquare(lb, ub, lengths):
+    root = isqrt(ub)
+    # e.g. output at least 4, although -2 is fine, -1, 0 and 1 are not
+    # so have to take lower bound as +2
+    lower = np.where(lb > 0, np.ceil(np.sqrt(np.maximum(lb, 0))).astype(np.int64), -root)
+    return noBounds(lower, root, ub < 0)
+
+def mapNegate(lb, ub, lengths):
+    return -ub, -lb
+
+def zipAdd(lb, ub, lengths):
+    lower = np.where(lb > 0, ceilDiv(lb, 2), truncDiv(lb, 2))
+    # the upper bound really does come from the output's lower bound when the output is all negative
+    upper = np.where(ub < 0, floorDiv(lb, 2), truncDiv(ub, 2))
+    return lower, upper
+
+def differenceBounds(lb, ub, divisor):
+    val = truncDiv(np.minimum(np.abs(lb), ub), divisor)
+    return noBounds(-val, val, (lb > 0) | (ub < 0))
+
+def zipSubtract(lb, ub, lengths):
+    return differenceBounds(lb, ub, 2)
+
+def zipMultiply(lb, ub, lengths):
+    val = np.minimum(isqrt(ub), np.ceil(np.sqrt(np.abs(lb))).astype(np.int64))
+    return noBounds(-val, val, ub < 0)
+
+def scanAdd(lb, ub, lengths):
+    lower = np.where(lb <= 0, truncDiv(lb, lengths), ceilDiv(lb, lengths))
+    upper = np.where(ub >= 0, truncDiv(ub, lengths), floorDiv(ub, lengths))
+    return lower, upper
+
+def scanSubtract(lb, ub, lengths):
+    return differenceBounds(lb, ub, lengths)
+
+def scanMultiply(lb, ub, lengths):
+    absbound = np.maximum(np.minimum(np.abs(lb), ub), 0)
+    # python's float power rather than np.power, which can land just under an exact root (27**(1/3))
+    val = np.array([int(a**(1/float(l))) for a, l in zip(absbound.tolist(), lengths.tolist())], dtype=np.int64)
+    return noBounds(-val, val, ub < 0)
+
+# (function, option): one (transfer, combine) per line input, where combine says how the new bound
+# goes with any bound later lines have already put on that input
+#   'meet'    intersect them
+#   'unset'   only use the new bound if there isn't one
+#   'replace' overwrite it
+boundTransfers = {
+    ('HEAD', None): [(sameBounds, 'meet')],
+    ('LAST', None): [(sameBounds, 'meet')],
+    ('MAXIMUM', None): [(sameBounds, 'meet')],
+    ('MINIMUM', None): [(sameBounds, 'meet')],
+    ('SORT', None): [(sameBounds, 'meet')],
+    ('REVERSE', None): [(sameBounds, 'meet')],
+    ('TAKE', None): [(anyValue, 'unset'), (sameBounds, 'meet')],
+    ('DROP', None): [(anyValue, 'unset'), (sameBounds, 'meet')],
+    ('ACCESS', None): [(anyValue, 'unset'), (sameBounds, 'meet')],
+    ('FILTER', '<0'): [(filterNegative, 'meet')],
+    ('FILTER', '>0'): [(filterPositive, 'meet')],
+    ('FILTER', '%2==0'): [(sameBounds, 'meet')],
+    ('FILTER', '%2==1'): [(sameBounds, 'meet')],
+    # the length of input matters, not the range
+    ('COUNT', '<0'): [(anyValue, 'unset')],
+    ('COUNT', '>0'): [(anyValue, 'unset')],
+    ('COUNT', '%2==0'): [(anyValue, 'unset')],
+    ('COUNT', '%2==1'): [(anyValue, 'unset')],
+    ('SUM', None): [(sumBounds, 'meet')],
+    ('MAP', '+1'): [(mapAdd(1), 'meet')],
+    ('MAP', '-1'): [(mapAdd(-1), 'meet')],
+    ('MAP', '*2'): [(mapMultiply(2), 'meet')],
+    ('MAP', '/2'): [(mapDivide(2), 'meet')],
+    ('MAP', '*3'): [(mapMultiply(3), 'meet')],
+    ('MAP', '/3'): [(mapDivide(3), 'meet')],
+    ('MAP', '*4'): [(mapMultiply(4), 'meet')],
+    ('MAP', '/4'): [(mapDivide(4), 'meet')],
+    ('MAP', '**2'): [(mapSquare, 'meet')],
+    ('MAP', '*(-1)'): [(mapNegate, 'meet')],
+    ('ZIPWITH', '+'): [(zipAdd, 'replace'), (zipAdd, 'replace')],
+    ('ZIPWITH', '-'): [(zipSubtract, 'replace'), (zipSubtract, 'replace')],
+    ('ZIPWITH', '*'): [(zipMultiply, 'replace'), (zipMultiply, 'replace')],
+    ('ZIPWITH', 'MAX'): [(sameBounds, 'replace'), (sameBounds, 'replace')],
+    ('ZIPWITH', 'MIN'): [(sameBounds, 'replace'), (sameBounds, 'replace')],
+    ('SCANL1', '+'): [(scanAdd, 'meet')],
+    ('SCANL1', '-'): [(scanSubtract, 'meet')],
+    ('SCANL1', '*'): [(scanMultiply, 'meet')],
+    ('SCANL1', 'MAX'): [(sameBounds, 'meet')],
+    ('SCANL1', 'MIN'): [(sameBounds, 'meet')],
+}
+
+# safe input ranges for every list length from 1 to maxListLength, as {length: bounds}
+# bounds has a (lower, upper) pair (or None) per program input, or is False if some input has been given an empty range
+def propagateBounds(program, maxListLength):
+    lengths = np.arange(1, maxListLength+1)
+    bounds = [None] * (len(program.lines)+2)
+    # initiate program output bounds i.e. output of final line
+    bounds[len(program.lines)-1] = anyValue(None, None, lengths)
+    # loop starts at final line and works backwards thru program
+    for index in reversed(range(len(program.lines))):
+        lineOutputBound = bounds[index]
+        assert(lineOutputBound is not None)
+        programLine = program.lines[index]
+        for ref, (transfer, combine) in zip(programLine.inputRefs, boundTransfers[(programLine.function, programLine.option)]):
+            existingBound = bounds[ref]
+            if existingBound is not None and combine == 'unset':
+                continue
+            lb, ub = transfer(lineOutputBound[0], lineOutputBound[1], lengths)
+            if existingBound is not None and combine == 'meet':
+                lb, ub = np.maximum(existingBound[0], lb), np.minimum(existingBound[1], ub)
+            bounds[ref] = (lb, ub)
+
+    inputBounds = bounds[-2:][::-1]
+    programBounds = {}
+    for k, length in enumerate(lengths.tolist()):
+        lengthBounds = [None if b is None else (int(b[0][k]), int(b[1][k])) for b in inputBounds]
         # check whether program inputs have been given empty range
-        for b in bounds[-2:]:
-            if b == None: continue
-            if b[0] >= b[1]: return False
+        if any(b is not None and b[0] >= b[1] for b in lengthBounds):
+            lengthBounds = False
+        programBounds[length] = lengthBounds
+    return programBounds
+
+# interval analysis results by (program string, max list length), least recently used dropped first
+# one per process, so a program that comes up again (train and test runs, several generators) is only analysed once.
+# with fileName set, results are also kept in that sqlite file and shared with other processes and later runs
+class BoundsCache:
+    def __init__(self, maxSize = 100000):
+        self.maxSize = maxSize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # open sqlite files by name, each process opens its own
+        self.stores = {}
+        self.storesPid = os.getpid()
+
+    def getStore(self, fileName):
+        if self.storesPid != os.getpid():
+            self.stores = {}
+            self.storesPid = os.getpid()
+        db = self.stores.get(fileName)
+        if db is None:
+            db = sqlite3.connect(fileName, timeout = 60, isolation_level = None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.execute('CREATE TABLE IF NOT EXISTS bounds (program TEXT, maxListLength INTEGER, bounds TEXT, PRIMARY KEY (program, maxListLength))')
+            self.stores[fileName] = db
+        return db
 
-        return bounds[-2:][::-1]
+    def get(self, program, maxListLength, fileName = None):
+        key = (program.toString(), maxListLength)
+        programBounds = self.entries.get(key)
+        if programBounds is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return programBounds
+        if fileName is not None:
+            row = self.getStore(fileName).execute('SELECT bounds FROM bounds WHERE program = ? AND maxListLength = ?', key).fetchone()
+            if row is not None:
+                programBounds = {length: b if b is False else [None if x is None else tuple(x) for x in b] for length, b in enumerate(json.loads(row[0]), 1)}
+        if programBounds is None:
+            self.misses += 1
+            programBounds = propagateBounds(program, maxListLength)
+            if fileName is not None:
+                self.getStore(fileName).execute('INSERT OR IGNORE INTO bounds VALUES (?, ?, ?)', key + (json.dumps([programBounds[length] for length in range(1, maxListLength+1)]),))
+        else:
+            self.hits += 1
+        self.entries[key] = programBounds
+        if len(self.entries) > self.maxSize:
+            self.entries.popitem(last = False)
+        return programBounds
+
+boundsCache = BoundsCache()
+
+class IOGeneratorRestrictedDomain(IOGeneratorBase):
+    # sqlite file to keep interval analysis results in across runs, see BoundsCache
+    boundsCacheFile = None
+
+    # safe input ranges for every list length, as {length: bounds}, see propagateBounds
+    def getProgramBounds(self, program):
+        return boundsCache.get(program, self.max_list_length, self.boundsCacheFile)
+
+    def backPropagateValues(self, program, listLength):
+        return self.getProgramBounds(program)[listLength]
 
     def getExamples(self, program):
         self.patience = 20
         resultSet = []
+        outputType = program.getOutputType()
+        width = self.max_list_length - 1
+        # safe ranges depend only on the program and the list length, so they're shared by every example
+        programBounds = self.getProgramBounds(program)
 
-        for __ in range(self.number_per_program):
-            tries = 0
-            acceptExample = False
-            programBounds = {}
-            while tries < self.patience and not acceptExample:
-                out = None
-
-                listLengths = []
-                for i in range(program.getNumberOfListInputs()):
-                    listLengths.append(np.random.randint(1, high=self.max_list_length))
-
-                # find safe range for each input
-                # but don't recalculate if we've had this length before
-                if programBounds.get(max(listLengths)) is None:
-                    programBounds[max(listLengths)] = self.backPropagateValues(program, max(listLengths))
-                bounds = programBounds[max(listLengths)]
-                if not bounds:
-                    tries += 1
-                    continue
+        # candidates are drawn as one stream, in rounds
+        # each example uses up candidates in order until one is accepted or it runs out of patience
+        tries = 0
+        examplesDone = 0
+        while examplesDone < self.number_per_program:
+            roundSize = self.candidateBatchSize
 
-                # generate input values uniformly at random from safe range
-                allInputs = []
-                i = 0
-                for n, programInput in enumerate(program.inputs):
-                    if programInput.type is list:
-                        inputLength = listLengths[i]
-                        numbers = np.random.randint(bounds[n][0], high=bounds[n][1]+1, size=inputLength)
-                        allInputs.append([int(val) for val in numbers])
-                        i += 1
-                    else:
-                        allInputs.append(int(np.random.randint(bounds[n][0], high=bounds[n][1]+1)))
+            listLengths = np.random.randint(1, high=self.max_list_length, size=(roundSize, program.getNumberOfListInputs()))
 
-                # checks
-                out = program.runWithChecks(allInputs, False)
-                if isinstance(out, tuple):
-                    out = list(out)
-                if self.outIsSuitable(out, tries):
-                    acceptExample = True
-                tries += 1
+            # safe range for each input
+            maxLengths = listLengths.max(axis=1)
+            roundBounds = [programBounds[int(length)] for length in maxLengths]
+            # tries where no safe range exists are used up without a candidate
+            valid = np.array([bool(b) for b in roundBounds])
 
-            if acceptExample:
-                resultSet.append((allInputs, out))
+            # generate input values uniformly at random from safe range
+            inputBatches = []
+            i = 0
+            for n, programInput in enumerate(program.inputs):
+                low = np.array([b[n][0] if b else 0 for b in roundBounds])
+                high = np.array([b[n][1]+1 if b else 1 for b in roundBounds])
+                if programInput.type is list:
+                    numbers = np.random.randint(low[:, None], high=high[:, None], size=(roundSize, width))
+                    inputBatches.append(dsl.batch.makeBatch(numbers, listLengths[:, i]))
+                    i += 1
+                else:
+                    numbers = np.random.randint(low, high=high)
+                    inputBatches.append(dsl.batch.intBatch(numbers, np.ones(roundSize, dtype=np.int64)))
+
+            # checks, for both the early and late suitability rules
+            accepted, outputs = program.runWithChecksBatch(inputBatches, False)
+            accepted &= valid
+            suitableEarly = self.outIsSuitableMany(outputType, accepted, outputs, np.zeros(roundSize, dtype=np.int64))
+            suitableLate = self.outIsSuitableMany(outputType, accepted, outputs, np.full(roundSize, self.patience))
+
+            late = int(self.patience*0.9)
+            for j in range(roundSize):
+                if examplesDone == self.number_per_program:
+                    break
+                suitable = suitableLate[j] if tries >= late else suitableEarly[j]
+                tries += 1
+                if suitable:
+                    out = outputs.getValue(j, outputType)
+                    if isinstance(out, tuple):
+                        out = list(out)
+                    resultSet.append((self.candidateInputs(program, inputBatches, j), out))
+                    examplesDone += 1
+                    tries = 0
+                elif tries == self.patience:
+                    # this example gives up, the next one starts afresh
+                    examplesDone += 1
+                    tries = 0
 
         return resultSet
 
+# alias table (Vose's method) for drawing from a discrete distribution in constant time per draw
+def makeAliasTable(probs):
+    n = len(probs)
+    scaled = np.asarray(probs, dtype=float) * n
+    prob = np.ones(n)
+    alias = np.arange(n)
+    small = [i for i in range(n) if scaled[i] < 1]
+    large = [i for i in range(n) if scaled[i] >= 1]
+    while small and large:
+        s = small.pop()
+        l = large.pop()
+        prob[s] = scaled[s]
+        alias[s] = l
+        scaled[l] = scaled[l] + scaled[s] - 1
+        if scaled[l] < 1:
+            small.append(l)
+        else:
+            large.append(l)
+    return prob, alias
+
+def sampleAlias(table, size):
+    prob, alias = table
+    i = np.random.randint(len(prob), size=size)
+    return np.where(np.random.random_sample(size) < prob[i], i, alias[i])
+
+# distribution of the largest magnitude allowed in an input list for IOGeneratorExpSampling
+lamd = 0.0001
+probsTemp = [lamd*np.power(np.e, -k*lamd) for k in range(256)]
+probsum = sum(probsTemp)
+probsExp = [x/probsum for x in probsTemp]
+expAliasTable = makeAliasTable(probsExp)
+
 class IOGeneratorExpSampling(IOGeneratorBase):
+    # list lengths for each try in a round, as the loop
+    #   if tries % 100 == 0 or max(listLengths) < 3: draw new listLengths
+    # would give them, carrying on from listLengths (one row per example) as the last round left them.
+    # returns the lengths for each example and candidate, and the lengths to carry into the next round
+    def drawListLengths(self, candidateTries, listLengths):
+        numExamples, numLists = listLengths.shape
+        roundSize = len(candidateTries)
+        index = np.arange(roundSize)
+        fresh = np.random.randint(1, high=self.max_list_length, size=(numExamples, roundSize, numLists))
+        good = fresh.max(axis=2) >= 3
+        # a redraw is triggered every 100 tries, or straight away if the lengths carried in are too short
+        trigger = np.tile(candidateTries % 100 == 0, (numExamples, 1))
+        trigger[:, 0] |= listLengths.max(axis=1) < 3
+        # and then repeats until a draw is long enough
+        lastTrigger = np.maximum.accumulate(np.where(trigger, index, -1), axis=1)
+        lastGood = np.maximum.accumulate(np.where(good, index, -1), axis=1)
+        lastGood = np.concatenate((np.full((numExamples, 1), -1), lastGood[:, :-1]), axis=1)
+        redraw = (lastTrigger >= 0) & (lastGood < lastTrigger)
+        source = np.maximum.accumulate(np.where(redraw, index, -1), axis=1)
+        drawn = np.take_along_axis(fresh, np.maximum(source, 0)[:, :, None], axis=1)
+        roundLengths = np.where((source >= 0)[:, :, None], drawn, listLengths[:, None, :])
+        return roundLengths, roundLengths[:, -1]
+
     def getExamples(self, program):
         self.patience = 500
-        resultSet = []
-        lamd = 0.0001
+        outputType = program.getOutputType()
+        width = self.max_list_length - 1
+        numLists = program.getNumberOfListInputs()
 
-        probsTemp = [lamd*np.power(np.e, -k*lamd) for k in range(256)]
-        probsum = sum(probsTemp)
-        probsExp = [x/probsum for x in probsTemp]
+        # every example is searched for at once, each with its own tries and list lengths,
+        # so a round is one block of candidates for all examples still open
+        results = [None]*self.number_per_program
+        openExamples = np.arange(self.number_per_program)
+        listLengths = np.zeros((self.number_per_program, numLists), dtype=np.int64)
+        tries = 0
+        while tries < self.patience and len(openExamples) > 0:
+            roundSize = min(self.candidateRoundSize(tries), self.patience - tries)
+            candidateTries = np.arange(tries, tries + roundSize)
+            # to prevent harder problems only finding short list examples
+            roundLengths, listLengths[openExamples] = self.drawListLengths(candidateTries, listLengths[openExamples])
+            tries += roundSize
+            blockSize = len(openExamples)*roundSize
+            roundLengths = roundLengths.reshape(blockSize, numLists)
 
-        for __ in range(self.number_per_program):
-            tries = 0
-            acceptExample = False
-            while (tries < self.patience) and not acceptExample:
-                # to prevent harder problems only finding short list examples
-                if tries % 100 == 0 or max(listLengths) < 3:
-                    listLengths = []
-                    for progIn in program.inputs:
-                        if progIn.type == list:
-                            listLengths.append(np.random.randint(1, high=self.max_list_length))
-
-                maxVal = np.random.choice(256,p=probsExp)
-
-                # generate input values uniformly at random from chosen range
-                allInputs = []
-                max_len = max(listLengths)
-                i = 0
-                for programInput in program.inputs:
-                    if programInput.type is list:
-                        inputLength = listLengths[i]
-                        signs = [2*x - 1 for x in np.random.randint(2, size=inputLength)]
-                        numbers = np.random.choice(maxVal+1, inputLength, p=None)
-                        signedInput = np.multiply(signs, numbers)
-                        allInputs.append([int(val) for val in signedInput])
-                        i += 1
-                    else:
-                        allInputs.append(int(np.random.randint(-max_len, max_len)))
+            maxVals = sampleAlias(expAliasTable, blockSize)
+
+            # generate input values uniformly at random from chosen range, for all list inputs at once
+            signs = 2*np.random.randint(2, size=(blockSize, numLists, width)) - 1
+            numbers = signs*np.random.randint(0, maxVals[:, None, None]+1, size=(blockSize, numLists, width))
+            max_lens = roundLengths.max(axis=1)
+            inputBatches = []
+            i = 0
+            for programInput in program.inputs:
+                if programInput.type is list:
+                    inputBatches.append(dsl.batch.makeBatch(numbers[:, i], roundLengths[:, i]))
+                    i += 1
+                else:
+                    ints = np.random.randint(-max_lens, max_lens)
+                    inputBatches.append(dsl.batch.intBatch(ints, np.ones(blockSize, dtype=np.int64)))
 
-                out = program.runWithChecks(allInputs, False)
+            accepted, outputs = program.runWithChecksBatch(inputBatches, False)
+            suitable = self.outIsSuitableMany(outputType, accepted, outputs, np.tile(candidateTries, len(openExamples)))
+            suitable = suitable.reshape(len(openExamples), roundSize)
+
+            # each example takes its first suitable candidate, as if it had tried them one at a time
+            found = suitable.any(axis=1)
+            for e in np.flatnonzero(found):
+                j = e*roundSize + int(np.argmax(suitable[e]))
+                out = outputs.getValue(j, outputType)
                 if isinstance(out, tuple):
                     out = list(out)
-                if self.outIsSuitable(out, tries):
-                    acceptExample = True
-                    resultSet.append((allInputs, out))
-                tries += 1
+                results[openExamples[e]] = (self.candidateInputs(program, inputBatches, j), out)
+            openExamples = openExamples[~found]
 
-        return resultSet
+        return [r for r in results if r is not None]
 
 class IOGeneratorConstraintBased(IOGeneratorBase):
+    # its many similar queries per program solve faster on the incremental solver (see oracleBenchmark.py),
+    # IOGeneratorVaried's queries with a timeout don't. pooled oracles get a fresh solver every
+    # z3BaseOracle.maxQueriesPerSolver queries, so retired queries' constraints don't pile up
+    z3Incremental = True
+
     def getExamples(self, program):
         return self.getExamplesfromZ3(program, self.number_per_program)
 
@@ -485,6 +983,9 @@ class IOGeneratorVaried(IOGeneratorBase):
     def getSampledIO(self, program, required):
         resultSet = []
         self.patience = 50
+        runWithChecks = program.compile('checked')
+        # for why a candidate failed its checks
+        runChecked = program.compile('report')
         maxVal = 256
         rateOfChange = np.ceil(self.patience/45)
 
@@ -503,29 +1004,40 @@ class IOGeneratorVaried(IOGeneratorBase):
         for __ in range(required):
             tries = 0
             acceptExample = False
+            lastFailure = None
             while (tries < self.patience) and not acceptExample:
-                if tries > 0 and tries % rateOfChange == 0: maxVal = updateSamplingRange(maxVal)
+                roundSize = min(self.candidateRoundSize(tries), self.patience - tries)
+                candidateTries = np.arange(tries, tries + roundSize)
+                maxVals = []
+                for t in candidateTries:
+                    # shrink on schedule, or straight away if the last round ended by pushing some line out of range
+                    if t > 0 and (t % rateOfChange == 0 or lastFailure == dsl.OUT_OF_RANGE): maxVal = updateSamplingRange(maxVal)
+                    lastFailure = None
+                    maxVals.append(maxVal)
+                maxVals = np.array(maxVals)
+                tries += roundSize
 
-                allInputs = []
+                inputBatches = []
                 i=0
                 for in_data in program.inputs:
                     if in_data.type == list:
                         inputLength = listLengths[i]
-                        signs = np.random.randint(2, size=inputLength)
-                        numbers = np.random.choice(maxVal+1, inputLength)
+                        signs = np.random.randint(2, size=(roundSize, inputLength))
+                        numbers = np.random.randint(0, maxVals[:, None]+1, size=(roundSize, inputLength))
                         signedInput = np.multiply(np.multiply(signs, 2)-1, numbers)
-                        allInputs.append([int(val) for val in signedInput])
+                        inputBatches.append(dsl.batch.makeBatch(signedInput, np.full(roundSize, inputLength)))
                         i+=1
                     else:
-                        allInputs.append(int(np.random.randint(-self.max_list_length, self.max_list_length)))
+                        numbers = np.random.randint(-self.max_list_length, self.max_list_length, size=roundSize)
+                        inputBatches.append(dsl.batch.intBatch(numbers, np.ones(roundSize, dtype=np.int64)))
 
                 # checks
-                out = program.runWithChecks(allInputs, False)
-                if isinstance(out, tuple):
-                    out = list(out)
-                if self.outIsSuitable(out, tries):
+                j, allInputs, out, accepted = self.firstSuitable(program, runWithChecks, inputBatches, candidateTries)
+                if j is not None:
                     acceptExample = True
-                tries += 1
+                elif not accepted[-1]:
+                    # the round's last candidate failed its checks, the report run says why
+                    lastFailure = runChecked(self.candidateInputs(program, inputBatches, roundSize-1), False).reason
 
             if acceptExample:
                 resultSet.append((allInputs, out))
@@ -0,0 +1,152 @@
+import dsl
+import inputGenerator
+import numpy as np
+import random
+import sys
+import time
+import z3InputsOracle
+
+# compares z3InputsOracle encodings (bit-vector widths) on the same programs and the same queries
+# reporting time spent encoding and solving, how many queries were satisfiable,
+# and how many examples found aren't really examples (running the program on the inputs doesn't give the output)
+
+# the (opcode, input ref, input ref) tuples setProgram takes, the second ref None for one-input lines, as IOGeneratorBase.getExamplesfromZ3 builds them
+def codifyProgram(program):
+    codifiedProgram = []
+    for l in program.lines:
+        thisLine = (l.opcode,)+tuple(l.inputRefs)
+        if len(l.inputRefs) == 1:
+            thisLine += (None,)
+        codifiedProgram.append(thisLine)
+    integerInputIndices = [i for i in range(len(program.inputs)) if program.inputs[i].type is int]
+    return integerInputIndices, codifiedProgram
+
+# inputs and output of an oracle result, in the form the IO generators use
+def decodeResult(program, res):
+    allInputs = res[1:][::-1]
+    for i, progIn in enumerate(program.inputs):
+        if progIn.type is int:
+            allInputs[i] = allInputs[i][0] if allInputs[i] else None
+    if program.getOutputType() is int:
+        out = res[0][0] if res[0] else None
+    else:
+        out = res[0]
+    return allInputs, out
+
+def isExample(program, allInputs, out):
+    result = program.run(allInputs)
+    if isinstance(result, tuple):
+        result = list(result)
+    return result == out
+
+# configurations is a list of z3InputsOracle keyword arguments, e.g. {'valueBits': 10} or {'incremental': True}
+# each program gets examplesPerProgram queries in the style of getExamplesfromZ3's basic mode,
+# with the same random minimum lengths for every configuration
+def benchmarkOracles(programStrings, configurations, max_list_length = 10, examplesPerProgram = 5, mode = 'basic', timeout = None, seed = 0):
+    results = []
+    for configuration in configurations:
+        rng = np.random.RandomState(seed)
+        stats = {'configuration': None, 'encodeTime': 0.0, 'solveTime': 0.0, 'queries': 0, 'sat': 0, 'wrong': 0}
+        for progString in programStrings:
+            program = dsl.Program.fromString(progString)
+            integerInputIndices, codifiedProgram = codifyProgram(program)
+            oracle = z3InputsOracle.z3InputsOracle(max_list_length, timeout, **configuration)
+            # as the oracle has it, with defaults filled in
+            stats['configuration'] = ' '.join(k+'='+str(getattr(oracle, k)) for k in configuration) or 'default'
+            oracle.setProgram(len(program.inputs), integerInputIndices, codifiedProgram, mode)
+            oracle.inputsNotNone()
+            oracle.distinctInandOut()
+            stats['encodeTime'] += oracle.encodeTime
+            for __ in range(examplesPerProgram):
+                oracle.beginAddConstraints()
+                minimumLengths = {}
+                for i, in_data in enumerate(program.inputs):
+                    minimumLengths[-(i+1)] = rng.randint(1, max_list_length//2 + 1) if in_data.type == list else 0
+                oracle.setInputMinimumLengths(minimumLengths)
+                if program.getOutputType() is int:
+                    oracle.outputNotNone()
+                startTime = time.time()
+                res = oracle.evalSatAndUpdateModel().removeAddedConstraints().getLastInputsAndOutputs()
+                stats['solveTime'] += time.time() - startTime
+                stats['queries'] += 1
+                if res is not None:
+                    stats['sat'] += 1
+                    allInputs, out = decodeResult(program, res)
+                    if not isExample(program, allInputs, out):
+                        stats['wrong'] += 1
+                    # so the next query looks for a different example
+                    oracle.excludeOutputs(out)
+        results.append(stats)
+    return results
+
+# widths is a list of (valueBits, lengthBits) pairs, lengthBits None for the oracle's default
+def benchmarkWidths(programStrings, widths, **kwargs):
+    return benchmarkOracles(programStrings, [{'valueBits': valueBits, 'lengthBits': lengthBits} for valueBits, lengthBits in widths], **kwargs)
+
+# IOGeneratorConstraintBased with and without z3ExampleSets, each from a fresh oracle pool:
+# seconds taken, examples found, ones that aren't really examples, and sets with a repeated output
+def benchmarkExampleSets(programStrings, number_per_program = 10, max_list_length = 10, examples_per_set = 5, seed = 0):
+    results = []
+    for exampleSets in [False, True]:
+        inputGenerator.oraclePool = inputGenerator.OraclePool()
+        generator = inputGenerator.IOGeneratorConstraintBased(None, programStrings, number_per_program, max_list_length, examples_per_set)
+        generator.z3ExampleSets = exampleSets
+        np.random.seed(seed)
+        stats = {'z3ExampleSets': exampleSets, 'time': 0.0, 'examples': 0, 'wrong': 0, 'repeats': 0}
+        for progString in programStrings:
+            program = dsl.Program.fromString(progString)
+            startTime = time.time()
+            examples = generator.getExamples(program)
+            stats['time'] += time.time() - startTime
+            stats['examples'] += len(examples)
+            stats['wrong'] += len([1 for allInputs, out in examples if not isExample(program, allInputs, out)])
+            for i in range(0, len(examples), examples_per_set):
+                outputs = [repr(out) for __, out in examples[i:i + examples_per_set]]
+                stats['repeats'] += len(outputs) != len(set(outputs))
+        stats.update(generator.z3Stats)
+        results.append(stats)
+    return results
+
+def printExampleSetResults(results, numberOfPrograms):
+    print('exampleSets  ms/prog  examples  wrong  repeats  set queries  fallbacks')
+    for stats in results:
+        print('{:>11} {:>8.1f} {:>9} {:>6} {:>8} {:>12} {:>10}'.format(
+            str(stats['z3ExampleSets']), 1000*stats['time']/numberOfPrograms, stats['examples'], stats['wrong'],
+            stats['repeats'], stats['exampleSets'], stats['exampleSetFallbacks']))
+
+def printResults(results, numberOfPrograms):
+    width = max(len(stats['configuration']) for stats in results)
+    print('configuration'.ljust(width)+'  encode ms/prog  solve ms/query  sat/queries  wrong')
+    for stats in results:
+        print('{}  {:>14.2f}  {:>14.2f}  {:>7}/{:<5} {:>5}'.format(
+            stats['configuration'].ljust(width),
+            1000*stats['encodeTime']/numberOfPrograms, 1000*stats['solveTime']/max(stats['queries'], 1),
+            stats['sat'], stats['queries'], stats['wrong']))
+
+# python oracleBenchmark.py widths programFile [numberOfPrograms] [valueBits ...]
+#   compares the 32-bit encoding with narrow ones (12 and 10 bit values by default)
+# python oracleBenchmark.py sets programFile [numberOfPrograms]
+#   compares solving an example set in one query with solving an example at a time
+# python oracleBenchmark.py incremental programFile [numberOfPrograms] [queriesPerProgram]
+#   compares push/pop on the tactic solver with selector literals on z3's incremental solver
+# on a random sample of the file's programs
+if __name__ == '__main__':
+    benchmark = sys.argv[1]
+    assert(benchmark in ['widths', 'sets', 'incremental'])
+    programFileName = sys.argv[2]
+    numberOfPrograms = int(sys.argv[3]) if len(sys.argv) > 3 else 50
+    with open(programFileName, 'r', encoding='utf-8') as f:
+        programStrings = [l for l in f if l.strip()]
+    random.seed(0)
+    programStrings = random.sample(programStrings, min(numberOfPrograms, len(programStrings)))
+    if benchmark == 'widths':
+        valueWidths = [int(x) for x in sys.argv[4:]] if len(sys.argv) > 4 else [12, 10]
+        results = benchmarkWidths(programStrings, [(32, 32)] + [(w, None) for w in valueWidths])
+        printResults(results, len(programStrings))
+    elif benchmark == 'incremental':
+        examplesPerProgram = int(sys.argv[4]) if len(sys.argv) > 4 else 10
+        results = benchmarkOracles(programStrings, [{'incremental': False}, {'incremental': True}], examplesPerProgram = examplesPerProgram)
+        printResults(results, len(programStrings))
+    else:
+        results = benchmarkExampleSets(programStrings)
+        printExampleSetResults(results, len(programStrings))
@@ -1,5 +1,15 @@
+import ast
 import dsl
+import gzip
+import hashlib
 import itertools
+import json
+import multiprocessing as mp
+import numpy as np
+import os
+import random
+import sqlite3
+import time
 
 class programGenerator:
     # rough check for equivalent programs
@@ -10,20 +20,57 @@ class programGenerator:
             'int': [3, 2, 0, -1, 2]
         }
 
-        def __init__(self):
-            self.testOutputs = {
-                ((-2, -3, -1, -1, -4, -2, -5), (1, 2, 4, 3, 1, 1), (-1, 0, 2, 0, -1), (7, 2, -6, 2, 9, -4, 1, 6, 1), (10, -2, 6, 2, 222, -1, 1, -8, -4, 4, 6)):0,
-                ((-2, 2, -3, 0, 1, 4), (-1, 8, 0, -2, 3, -1), (1, 3, 7), (4, -8, 2, 6, -3, -1, 2, 8, 8, 0), (-1, 1, -2, -3, 7, -3)):0,
-                (3, 2, 0, -1, 2):0
-            }
+        # by default the bank is just the test inputs above, and outputs are stored whole
+        # bankSize extends the bank with seeded random inputs (the fixed ones always come first)
+        # hashBits (64 or 128) stores a blake2b fingerprint of each output in place of the output itself.
+        # each fingerprint is kept with 64 more bits of the same digest, so two outputs sharing a fingerprint are still told apart,
+        # and only those get stored whole.
+        # batched evaluates candidates on the bank with the numpy batch executor, which pays off for large banks
+        def __init__(self, bankSize = None, seed = 0, hashBits = None, batched = False):
+            assert(hashBits in [None, 64, 128])
+            self.bankSize = bankSize
+            self.seed = seed
+            self.hashBits = hashBits
+            self.batched = batched
+            # an EnumerationStore sets this to a list, to collect new entries until its next checkpoint
+            self.added = None
+            self.testInputs = self.makeTestInputs(bankSize, seed)
+            self.testOutputs = {}
+            self.collisions = {}
+            # the program inputs themselves are taken, as id 0
+            self.acceptOutput(tuple(tuple(x) for x in self.testInputs['list1']), 0)
+            self.acceptOutput(tuple(tuple(x) for x in self.testInputs['list2']), 0)
+            self.acceptOutput(tuple(self.testInputs['int']), 0)
 
-        def acceptProgram(self, program, id, inputTypes):
+        @classmethod
+        def makeTestInputs(cls, bankSize, seed):
+            if bankSize is None:
+                return cls.testInputs
+            rng = np.random.RandomState(seed)
+            bank = {k: v[:bankSize] for k, v in cls.testInputs.items()}
+            for __ in range(bankSize - len(bank['int'])):
+                for k in ['list1', 'list2']:
+                    bank[k].append([int(x) for x in rng.randint(-10, 11, size=rng.randint(1, 12))])
+                bank['int'].append(int(rng.randint(-5, 6)))
+            return bank
+
+        # test inputs for a program signature, one tuple per program input
+        def getTestInputs(self, inputTypes):
             if inputTypes == [list]:
-                out = program.runMany(zip(self.testInputs['list1']))
+                return [tuple(self.testInputs['list1'])]
             elif inputTypes == [list, list]:
-                out = program.runMany(zip(self.testInputs['list1'], self.testInputs['list2']))
+                return [tuple(self.testInputs['list1']), tuple(self.testInputs['list2'])]
             elif inputTypes == [list, int]:
-                out = program.runMany(zip(self.testInputs['list1'], self.testInputs['int']))
+                return [tuple(self.testInputs['list1']), tuple(self.testInputs['int'])]
+
+        def acceptProgram(self, program, id, inputTypes):
+            out = program.runMany(zip(*self.getTestInputs(inputTypes)))
+            return self.acceptOutput(out, id)
+
+        # out is a program's output on the test inputs, as given by runMany
+        def acceptOutput(self, out, id):
+            if self.hashBits is not None:
+                return self.acceptFingerprint(out, id)
             # lookup id of equivalent programs
             equiv = self.testOutputs.get(out, None)
             if equiv is not None:
@@ -31,69 +78,515 @@ class programGenerator:
                 return False, equiv
             # passed - add to output sets
             self.testOutputs[out] = id
+            if self.added is not None:
+                self.added.append((EnumerationStore.OUTPUT, out, id, None))
+            return True, None
+
+        # id of an accepted program with the same output, None if there isn't one yet
+        def findEquivalent(self, out):
+            if self.hashBits is None:
+                return self.testOutputs.get(out, None)
+            key, check = self.getFingerprint(out)
+            entry = self.testOutputs.get(key, None)
+            if entry is not None and entry[1] == check:
+                return entry[0]
+            return self.collisions.get(out, None)
+
+        # index key for an output, plus the extra bits that tell apart outputs sharing a key
+        def getFingerprint(self, out):
+            digest = hashlib.blake2b(repr(out).encode(), digest_size = self.hashBits//8 + 8).digest()
+            return digest[:self.hashBits//8], int.from_bytes(digest[self.hashBits//8:], 'little', signed = True)
+
+        def acceptFingerprint(self, out, id):
+            key, check = self.getFingerprint(out)
+            entry = self.testOutputs.get(key, None)
+            if entry is None:
+                self.testOutputs[key] = (id, check)
+                if self.added is not None:
+                    self.added.append((EnumerationStore.FINGERPRINT, key, id, check))
+                return True, None
+            equiv, savedCheck = entry
+            if savedCheck == check:
+                return False, equiv
+            # a genuine fingerprint collision, so fall back to the whole output
+            equiv = self.collisions.get(out, None)
+            if equiv is not None:
+                return False, equiv
+            self.collisions[out] = id
+            if self.added is not None:
+                self.added.append((EnumerationStore.COLLISION, out, id, None))
             return True, None
 
     # for simplicity all programs will have either one or two inputs
     progInputs = [[list], [list, int], [list, list]]
 
-    def __init__(self):
-        self.checker = self.EquivalenceChecker()
+    # bankSize, seed, hashBits and batched are passed on to the EquivalenceChecker
+    # prune skips candidates matching the rules in dsl.rules without running them, and verifyPruning runs them anyway to check
+    def __init__(self, bankSize = None, seed = 0, hashBits = None, batched = False, prune = False, verifyPruning = False):
+        self.checker = self.EquivalenceChecker(bankSize, seed, hashBits, batched)
+        self.pruner = None
+        if prune:
+            self.pruner = dsl.RulePruner(verify = verifyPruning)
 
     # all the ways for the program input slots to be filled
-    def getLineInputs(self, pIns, skeletonProgram, n):
+    # in the same order as the product of every line's options, yielded one at a time.
+    # given a random.Random, each line's options are tried in a random order instead, which makes the first wiring a random one
+    def getLineInputs(self, pIns, skeletonProgram, n, rng = None):
+        # skeleton lines can be composite function strings or registry opcodes
+        skeletonProgram = [dsl.registry.toOpcode(f) for f in skeletonProgram]
         # what ints and lists are given and calulated during the program
         availableInputs = {int: [], list: []}
+        valueTypes = {}
         for i, progInType in enumerate(pIns):
             availableInputs[progInType].append(-(i+1))
+            valueTypes[-(i+1)] = progInType
+        # required to use all input and calculated values in a program -- but not the final output
+        # unused counts the values of each type still waiting to be used, slots the input slots left to take them
+        unused = {int: 0, list: 0}
+        slots = {int: 0, list: 0}
+        lineOpts = []
+        lineSlots = []
         for i in range(n):
-            lineOutputType = dsl.getFunctionOutput(skeletonProgram[i])
+            # line expects fixed var types in fixed order
+            requiredInputs = dsl.registry.inputTypes[skeletonProgram[i]]
+            # we can use program inputs plus line outputs from earlier lines provided type matches
+            lineOpts.append([tuple(availableInputs[t]) for t in requiredInputs])
+            lineSlots.append(requiredInputs)
+            for t in requiredInputs:
+                slots[t] += 1
+            lineOutputType = dsl.registry.outputType[skeletonProgram[i]]
             availableInputs[lineOutputType].append(i)
+            valueTypes[i] = lineOutputType
+        for x, t in valueTypes.items():
+            if x != n-1: unused[t] += 1
+        if unused[int] > slots[int] or unused[list] > slots[list]:
+            return iter(())
+        # outputs of lines k onwards can only be taken by the lines after them, so check there are enough slots there too
+        produced = {int: 0, list: 0}
+        laterSlots = {int: 0, list: 0}
+        for k in range(n-1, 0, -1):
+            for t in lineSlots[k]:
+                laterSlots[t] += 1
+            produced[valueTypes[k-1]] += 1
+            if produced[int] > laterSlots[int] or produced[list] > laterSlots[list]:
+                return iter(())
+        uses = dict.fromkeys(valueTypes, 0)
 
-        allInputsOptions = []
-        for i in range(n):
-            lineOpts = []
-            # line expects fixed var types in fixed order
-            requiredInputs = dsl.getFunctionInputs(skeletonProgram[i])
-            for lineInputType in requiredInputs:
-                # we can use program inputs plus line outputs from earlier lines provided type matches
-                lineOpts.append(list(filter(lambda x: x<i, availableInputs[lineInputType])))
-            # it is almost never interesting to have a line take the same input twice
-            filteredLineOpts = list(filter(lambda x: len(set(x)) == len(x), list(itertools.product(*lineOpts))))
-            allInputsOptions.append(filteredLineOpts)
-
-        finalLineInputs = list(itertools.product(*allInputsOptions))
-        # flatten out the options so each possibility is a single list of inputs in the order they can be used
-        finalLineInputs = [[x for y in b for x in y] for b in finalLineInputs]
-        # required to use all input and calculated values in a program -- but not the final output
-        all = (set(availableInputs[int]) | set(availableInputs[list])) - {n-1}
-        return list(filter(lambda x: set(x) == all, finalLineInputs))
+        # wirings are built a line at a time, and a partial wiring is dropped as soon as
+        # the values it still has to use (including outputs of lines not yet filled) outnumber the slots left
+        def fillLines(i, wiring):
+            if i == n:
+                yield wiring
+                return
+            for t in lineSlots[i]:
+                slots[t] -= 1
+            lineChoices = itertools.product(*lineOpts[i])
+            if rng is not None:
+                lineChoices = list(lineChoices)
+                rng.shuffle(lineChoices)
+            for lineIns in lineChoices:
+                # it is almost never interesting to have a line take the same input twice
+                if len(set(lineIns)) != len(lineIns): continue
+                for x in lineIns:
+                    uses[x] += 1
+                    if uses[x] == 1: unused[valueTypes[x]] -= 1
+                if unused[int] <= slots[int] and unused[list] <= slots[list]:
+                    yield from fillLines(i+1, wiring + list(lineIns))
+                for x in lineIns:
+                    uses[x] -= 1
+                    if uses[x] == 0: unused[valueTypes[x]] += 1
+            for t in lineSlots[i]:
+                slots[t] += 1
 
-    def getAllUpToMLines(self, m, folderName):
-        progId = 1
-        for n in range(1,m+1):
-            accepted = []
-            failed = []
-            for inputs in self.progInputs:
-                lineFunctions = [dsl.getCompositeFunctionKeys()]*n
+        return fillLines(0, [])
+
+    # yields (n, progId, program string, clash) for every candidate as it's classified, clash is None for accepted programs
+    # a position is (n, signature index, skeleton index, progId), and start picks up from one.
+    # onCheckpoint is called with the position before each skeleton (and once past the end),
+    # at which point every earlier candidate has been classified and handed on, and no later one has
+    def iterAllUpToMLines(self, m, start = (1, 0, 0, 1), onCheckpoint = None):
+        startN, startSignature, startSkeleton, progId = start
+        for n in range(startN,m+1):
+            for s, inputs in enumerate(self.progInputs):
+                if (n, s) < (startN, startSignature): continue
+                firstSkeleton = startSkeleton if (n, s) == (startN, startSignature) else 0
+                # line outputs on the test inputs are cached per program prefix, so each candidate only runs its last line
+                trie = dsl.PrefixTrie(self.checker.getTestInputs(inputs), self.checker.batched)
+                lineFunctions = [range(len(dsl.registry))]*n
                 # skeleton programs created by taking all the combinations of funcs at each line
-                for skeletonProg in itertools.product(*lineFunctions):
+                skeletons = itertools.islice(itertools.product(*lineFunctions), firstSkeleton, None)
+                for k, skeletonProg in enumerate(skeletons, firstSkeleton):
+                    if onCheckpoint is not None:
+                        onCheckpoint((n, s, k, progId))
+                    lineRules = None
+                    if self.pruner is not None:
+                        lineRules = self.pruner.getLineRules(skeletonProg)
                     # fill in the possible inputs for each line in the proposed program
                     # and contruct the full programs
                     for inputChoice in self.getLineInputs(inputs, skeletonProg, n):
-                        # create program and hand to equivalence checker to decide whether to keep it
-                        candidate = dsl.Program(inputs, skeletonProg, list(inputChoice))
-                        acceptProg, clash = self.checker.acceptProgram(candidate, progId, inputs)
+                        if lineRules and self.isPruned(trie, skeletonProg, inputChoice, lineRules):
+                            # pruned candidates still use up their progId, so the rest keep the ids of an unpruned run
+                            progId += 1
+                            continue
+                        # evaluate on the test inputs and hand to equivalence checker to decide whether to keep it
+                        out = trie.evaluate(skeletonProg, inputChoice)
+                        acceptProg, clash = self.checker.acceptOutput(out, progId)
+                        yield n, progId, dsl.Program(inputs, skeletonProg, list(inputChoice)).toString(), clash
+                        progId += 1
+        if onCheckpoint is not None:
+            onCheckpoint((m+1, 0, 0, progId))
+
+    # yields count distinct n-line programs drawn at random, as (n, progId, program string, None), for lengths too long to enumerate.
+    # skeletons are drawn with weights keyed by composite function ('MAP,*2') or function ('MAP'), 1 for anything not given,
+    # and wired by getLineInputs trying options in a random order, so the wiring rules are the same as for enumeration.
+    # anything the EquivalenceChecker has already seen (or the pruning rules match) is dropped.
+    # progress is kept in samplingStats, and drawing stops after maxTries programs (default 1000 per program wanted)
+    def iterSampledPrograms(self, n, count, weights = {}, seed = None, startId = 1, maxTries = None):
+        if maxTries is None:
+            maxTries = 1000*count
+        rng = random.Random(seed)
+        registry = dsl.registry
+        functionWeights = [weights.get(k, weights.get(registry.functionIds[op], 1)) for op, k in enumerate(registry.keys)]
+        tries = {tuple(inputs): dsl.PrefixTrie(self.checker.getTestInputs(inputs), self.checker.batched) for inputs in self.progInputs}
+        stats = {'drawn': 0, 'unwirable': 0, 'pruned': 0, 'duplicates': 0, 'accepted': 0, 'seconds': 0, 'programsPerSecond': 0}
+        self.samplingStats = stats
+        startTime = time.time()
+        progId = startId
+        while stats['accepted'] < count and stats['drawn'] < maxTries:
+            stats['drawn'] += 1
+            inputs = rng.choice(self.progInputs)
+            skeletonProg = tuple(rng.choices(range(len(registry)), functionWeights, k = n))
+            inputChoice = next(self.getLineInputs(inputs, skeletonProg, n, rng), None)
+            if inputChoice is None:
+                stats['unwirable'] += 1
+                continue
+            trie = tries[tuple(inputs)]
+            if self.pruner is not None:
+                lineRules = self.pruner.getLineRules(skeletonProg)
+                if lineRules and self.isPruned(trie, skeletonProg, inputChoice, lineRules):
+                    stats['pruned'] += 1
+                    continue
+            acceptProg, clash = self.checker.acceptOutput(trie.evaluate(skeletonProg, inputChoice), progId)
+            if not acceptProg:
+                stats['duplicates'] += 1
+                continue
+            stats['accepted'] += 1
+            stats['seconds'] = time.time() - startTime
+            stats['programsPerSecond'] = stats['accepted'] / max(stats['seconds'], 1e-9)
+            yield n, progId, dsl.Program(inputs, skeletonProg, inputChoice).toString(), None
+            progId += 1
+
+    # writes count sampled n-line programs to nProgs.txt, see iterSampledPrograms
+    def sampleProgramsOfLength(self, n, count, folderName, weights = {}, seed = None, startId = 1, maxTries = None):
+        writers = {}
+        try:
+            self.openWriters(writers, [n], folderName, 'skip')
+            self.writeTo(writers, self.iterSampledPrograms(n, count, weights, seed, startId, maxTries))
+        finally:
+            self.closeWriters(writers)
+        return self.samplingStats
+
+    # checks a candidate against the pruning rules, counting (and with verifyPruning, checking) the ones it removes
+    def isPruned(self, trie, skeletonProg, inputChoice, lineRules):
+        r = self.pruner.match(skeletonProg, inputChoice, lineRules)
+        if r is None:
+            return False
+        self.pruner.removed[r] += 1
+        if self.pruner.verify and self.checker.findEquivalent(trie.evaluate(skeletonProg, inputChoice)) is None:
+            self.pruner.notEquivalent[r] += 1
+        return True
+
+    # same programs, ids and clashes as iterAllUpToMLines, with the work sharded across processes
+    # shards are (length, signature, first line function), each covering a consecutive run of progIds.
+    # workers only dedupe within their shard, so equivalences across shards are settled here, in progId order
+    # pruning happens in the workers, which can't see the full index, so verifyPruning isn't supported here
+    def iterAllUpToMLinesParallel(self, m, n_workers = None):
+        if n_workers is None:
+            n_workers = mp.cpu_count()
+        prune = self.pruner is not None
+        assert(not (prune and self.pruner.verify))
+        shards = [(n, inputs, f, self.checker.getTestInputs(inputs), self.checker.batched, prune) for n in range(1,m+1) for inputs in self.progInputs for f in range(len(dsl.registry))]
+        progId = 1
+        with mp.Pool(processes = n_workers) as pool:
+            for shard, (programStrings, classes, classOutputs, removed) in zip(shards, pool.imap(enumerateShard, shards)):
+                n = shard[0]
+                if prune:
+                    self.pruner.removed = [a + b for a, b in zip(self.pruner.removed, removed)]
+                # global id of each of the shard's classes, in the order they first appear
+                classIds = []
+                for progString, c in zip(programStrings, classes):
+                    if progString is None:
+                        # pruned
+                        progId += 1
+                        continue
+                    if c == len(classIds):
+                        acceptProg, clash = self.checker.acceptOutput(classOutputs[c], progId)
+                        classIds.append(progId if acceptProg else clash)
+                    else:
+                        clash = classIds[c]
+                    yield n, progId, progString, clash
+                    progId += 1
+
+    # failedLog is 'write', 'gzip' (to nFailed.txt.gz) or 'skip'
+    def getAllUpToMLines(self, m, folderName, failedLog = 'write', n_workers = 1):
+        if n_workers == 1:
+            programs = self.iterAllUpToMLines(m)
+        else:
+            programs = self.iterAllUpToMLinesParallel(m, n_workers)
+        self.writePrograms(programs, m, folderName, failedLog)
+
+    # writes nProgs.txt and nFailed.txt for n = 1..m as programs arrive, so nothing is held in memory
+    def writePrograms(self, programs, m, folderName, failedLog = 'write'):
+        writers = {}
+        try:
+            self.openWriters(writers, range(1,m+1), folderName, failedLog)
+            self.writeTo(writers, programs)
+        finally:
+            self.closeWriters(writers)
+
+    # adds (accepted, failed) writers for each length to writers
+    # lengths found in offsets carry on from those offsets in existing files, anything after them is dropped
+    def openWriters(self, writers, lengths, folderName, failedLog, offsets = {}):
+        assert(failedLog in ['write', 'gzip', 'skip'])
+        for n in lengths:
+            acceptedOffset, failedOffset = offsets.get(n, (None, None))
+            accepted = ProgramWriter(folderName+'/'+str(n)+'Progs.txt', offset = acceptedOffset)
+            failed = None
+            if failedLog != 'skip':
+                failed = ProgramWriter(folderName+'/'+str(n)+'Failed.txt', failedLog == 'gzip', offset = failedOffset)
+            writers[n] = (accepted, failed)
+
+    def writeTo(self, writers, programs):
+        for n, progId, progString, clash in programs:
+            accepted, failed = writers[n]
+            if clash is None:
+                accepted.write(str(progId)+'\\'+progString+'\n')
+            elif failed is not None:
+                failed.write(str(progId)+'\\'+progString+'\\'+str(clash)+'\n')
+
+    def closeWriters(self, writers):
+        for accepted, failed in writers.values():
+            accepted.close()
+            if failed is not None:
+                failed.close()
+
+    # getAllUpToMLines, saving its progress to an EnumerationStore in storeFileName every so many programs
+    # if the store already holds a checkpoint the run carries on from there, truncating the files back to match it,
+    # and if that run finished below m lines it is extended rather than redone.
+    # extendFrom instead starts a new store from the nProgs.txt files of an earlier run up to that many lines
+    def getAllUpToMLinesResumable(self, m, folderName, storeFileName, failedLog = 'write', checkpointEvery = 100000, extendFrom = None):
+        # gzip files can't be truncated back to a checkpoint
+        assert(failedLog in ['write', 'skip'])
+        store = EnumerationStore(storeFileName)
+        writers = {}
+        try:
+            start, offsets = store.load(self.checker)
+            if start is None:
+                start = (1, 0, 0, 1)
+                if extendFrom is not None:
+                    start = self.loadExisting(extendFrom, folderName)
+            self.openWriters(writers, range(start[0],m+1), folderName, failedLog, offsets)
+            lastCheckpoint = start[3]
+
+            def checkpoint(position):
+                nonlocal lastCheckpoint
+                if position[3] - lastCheckpoint < checkpointEvery and position[0] <= m:
+                    return
+                offsets = {}
+                for n, (accepted, failed) in writers.items():
+                    offsets[n] = (accepted.tell(), None if failed is None else failed.tell())
+                store.save(self.checker, position, offsets)
+                lastCheckpoint = position[3]
+
+            self.writeTo(writers, self.iterAllUpToMLines(m, start, checkpoint))
+        finally:
+            self.closeWriters(writers)
+            store.close()
+
+    # rebuilds the equivalence index from the nProgs.txt files of a finished run up to n lines
+    # and returns the position to carry on from with n+1 lines.
+    # the next progId comes from the last line of nProgs.txt and nFailed.txt, so without a failed log
+    # it can't account for failed programs after the last accepted one
+    def loadExisting(self, n, folderName):
+        lastId = 0
+        for k in range(1,n+1):
+            with open(folderName+'/'+str(k)+'Progs.txt', 'r', encoding='utf-8') as f:
+                for progString in f:
+                    progId, progString = progString.split('\\', 1)
+                    p = dsl.Program.fromString(progString)
+                    out = p.runMany(zip(*self.checker.getTestInputs([x.type for x in p.inputs])))
+                    self.checker.acceptOutput(out, int(progId))
+                    lastId = max(lastId, int(progId))
+        failedFileName = folderName+'/'+str(n)+'Failed.txt'
+        if os.path.exists(failedFileName):
+            with open(failedFileName, 'r', encoding='utf-8') as f:
+                for progString in f:
+                    lastId = max(lastId, int(progString.split('\\', 1)[0]))
+        return (n+1, 0, 0, lastId+1)
+
+    # ways to fill the inputs of a new line added after the lines of skeletonProgram
+    # the new line must take the current final output, so the extended program still uses every value
+    def getExtensionInputs(self, pIns, skeletonProgram, newFunction):
+        n = len(skeletonProgram)
+        availableInputs = {int: [], list: []}
+        for i, progInType in enumerate(pIns):
+            availableInputs[progInType].append(-(i+1))
+        for i in range(n):
+            availableInputs[dsl.registry.outputType[skeletonProgram[i]]].append(i)
+        lineOpts = [availableInputs[t] for t in dsl.registry.inputTypes[newFunction]]
+        return [list(x) for x in itertools.product(*lineOpts) if len(set(x)) == len(x) and n-1 in x]
+
+    # level-wise alternative to getAllUpToMLines
+    # n-line candidates are only built by adding a line to the accepted (n-1)-line programs, whose line outputs are kept
+    # so each candidate costs one line and the work grows with the number of distinct behaviours, not the number of skeletons.
+    # this only reaches programs whose prefixes were all accepted themselves, so it finds a subset of what getAllUpToMLines does
+    def iterAllUpToMLinesBottomUp(self, m):
+        progId = 1
+        # one trie per signature, only used here to evaluate single lines against the test inputs
+        evaluators = {tuple(inputs): dsl.PrefixTrie(self.checker.getTestInputs(inputs), self.checker.batched) for inputs in self.progInputs}
+        # accepted programs of the previous length as (inputs, line functions, line input refs, line outputs)
+        frontier = []
+        for n in range(1,m+1):
+            nextFrontier = []
+            if n == 1:
+                extensions = [(inputs, (), [], []) for inputs in self.progInputs]
+            else:
+                extensions = frontier
+            for inputs, skeletonProg, inputChoice, lineOutputs in extensions:
+                for f in range(len(dsl.registry)):
+                    if n == 1:
+                        lineInputs = self.getLineInputs(inputs, (f,), 1)
+                    else:
+                        lineInputs = self.getExtensionInputs(inputs, skeletonProg, f)
+                    # earlier lines were already checked when they were added, so only the new one can match a rule
+                    lineRules = None
+                    if self.pruner is not None and f in self.pruner.rulesByFunction:
+                        lineRules = [(n-1, self.pruner.rulesByFunction[f])]
+                    for newInputs in lineInputs:
+                        evaluator = evaluators[tuple(inputs)]
+                        if lineRules and self.isPruned(evaluator, skeletonProg+(f,), inputChoice+newInputs, lineRules):
+                            progId += 1
+                            continue
+                        out = evaluator.evaluateLine(f, tuple(newInputs), lineOutputs)
+                        acceptProg, clash = self.checker.acceptOutput(evaluator.toValues(f, out), progId)
                         if acceptProg:
-                            accepted.append(str(progId)+'\\'+candidate.toString()+'\n')
-                        else:
-                            failed.append(str(progId)+'\\'+candidate.toString()+'\\'+str(clash)+'\n')
+                            nextFrontier.append((inputs, skeletonProg+(f,), inputChoice+newInputs, lineOutputs+[out]))
+                        yield n, progId, dsl.Program(inputs, skeletonProg+(f,), inputChoice+newInputs).toString(), clash
                         progId += 1
-            # write out generated programs
-            fileName = folderName+'/'+str(n)+'Progs.txt'
-            failedFileName = folderName+'/'+str(n)+'Failed.txt'
-            with open(fileName, 'w', encoding='utf-8') as f:
-                for acc in accepted:
-                    f.write(acc)
-            with open(failedFileName, 'w', encoding='utf-8') as f1:
-                for fail in failed:
-                    f1.write(fail)
+            frontier = nextFrontier
+
+    def getAllUpToMLinesBottomUp(self, m, folderName, failedLog = 'write'):
+        self.writePrograms(self.iterAllUpToMLinesBottomUp(m), m, folderName, failedLog)
+
+# enumerates one shard for iterAllUpToMLinesParallel: the n-line programs for one signature with a fixed first line function
+# returns the program strings (None for pruned candidates), the local equivalence class of each one
+# (numbered in order of first appearance), the test outputs of each class and the pruning counts
+def enumerateShard(shard):
+    n, inputs, firstFunction, testInputs, batched, prune = shard
+    generator = programGenerator(prune = prune)
+    trie = dsl.PrefixTrie(testInputs, batched)
+    localOutputs = {}
+    programStrings = []
+    classes = []
+    lineFunctions = [[firstFunction]] + [range(len(dsl.registry))]*(n-1)
+    for skeletonProg in itertools.product(*lineFunctions):
+        lineRules = None
+        if prune:
+            lineRules = generator.pruner.getLineRules(skeletonProg)
+        for inputChoice in generator.getLineInputs(inputs, skeletonProg, n):
+            if lineRules and generator.isPruned(trie, skeletonProg, inputChoice, lineRules):
+                programStrings.append(None)
+                classes.append(None)
+                continue
+            out = trie.evaluate(skeletonProg, inputChoice)
+            c = localOutputs.setdefault(out, len(localOutputs))
+            programStrings.append(dsl.Program(inputs, skeletonProg, list(inputChoice)).toString())
+            classes.append(c)
+    removed = generator.pruner.removed if prune else None
+    return programStrings, classes, list(localOutputs), removed
+
+# writes program file lines in chunks rather than one at a time
+# given an offset, an existing file is cut back to it and added to
+class ProgramWriter:
+    def __init__(self, fileName, compress = False, chunkSize = 10000, offset = None):
+        if compress:
+            self.f = gzip.open(fileName+'.gz', 'wt', encoding='utf-8')
+        elif offset is not None:
+            self.f = open(fileName, 'r+', encoding='utf-8')
+            self.f.seek(offset)
+            self.f.truncate()
+        else:
+            self.f = open(fileName, 'w', encoding='utf-8')
+        self.chunkSize = chunkSize
+        self.chunk = []
+
+    def write(self, line):
+        self.chunk.append(line)
+        if len(self.chunk) >= self.chunkSize:
+            self.flush()
+
+    def flush(self):
+        self.f.writelines(self.chunk)
+        self.chunk = []
+
+    # offset of everything written so far
+    def tell(self):
+        self.flush()
+        self.f.flush()
+        return self.f.tell()
+
+    def close(self):
+        self.flush()
+        self.f.close()
+
+# sqlite file holding an enumeration's equivalence index, its position and how far each output file had got at that point
+# everything is saved in one transaction, so the store always matches a single checkpoint
+class EnumerationStore:
+    # kinds of equivalence index entry
+    OUTPUT = 0
+    FINGERPRINT = 1
+    COLLISION = 2
+
+    def __init__(self, fileName):
+        self.db = sqlite3.connect(fileName)
+        self.db.execute('CREATE TABLE IF NOT EXISTS outputs (kind INTEGER, key BLOB, id INTEGER, hash INTEGER, PRIMARY KEY (kind, key))')
+        self.db.execute('CREATE TABLE IF NOT EXISTS checkpoint (n INTEGER, signature INTEGER, skeleton INTEGER, progId INTEGER, config TEXT, offsets TEXT)')
+        self.db.commit()
+
+    # checker options that change what's in the index, which have to match on resume
+    def getConfig(self, checker):
+        return repr((checker.bankSize, checker.seed, checker.hashBits))
+
+    # fills checker from the store and has it collect new entries from now on
+    # returns the saved position and file offsets, or None and no offsets for a new store
+    def load(self, checker):
+        checker.added = []
+        row = self.db.execute('SELECT n, signature, skeleton, progId, config, offsets FROM checkpoint').fetchone()
+        if row is None:
+            return None, {}
+        if row[4] != self.getConfig(checker):
+            raise ValueError('EquivalenceChecker options {} do not match the store {}'.format(self.getConfig(checker), row[4]))
+        for kind, key, id, check in self.db.execute('SELECT kind, key, id, hash FROM outputs'):
+            if kind == self.OUTPUT:
+                checker.testOutputs[ast.literal_eval(key.decode())] = id
+            elif kind == self.FINGERPRINT:
+                checker.testOutputs[key] = (id, check)
+            else:
+                checker.collisions[ast.literal_eval(key.decode())] = id
+        offsets = {int(n): tuple(o) for n, o in json.loads(row[5]).items()}
+        return tuple(row[:4]), offsets
+
+    def save(self, checker, position, offsets):
+        rows = []
+        for kind, key, id, check in checker.added:
+            if kind != self.FINGERPRINT:
+                key = repr(key).encode()
+            rows.append((kind, key, id, check))
+        with self.db:
+            self.db.executemany('INSERT OR REPLACE INTO outputs VALUES (?, ?, ?, ?)', rows)
+            self.db.execute('DELETE FROM checkpoint')
+            self.db.execute('INSERT INTO checkpoint VALUES (?, ?, ?, ?, ?, ?)', tuple(position) + (self.getConfig(checker), json.dumps(offsets)))
+        checker.added = []
+
+    def close(self):
+        self.db.close()
@@ -1,4 +1,5 @@
 import random
+import numpy as np
 
 def splitTrainAndTestRandom(programFileName, frac_for_training):
     training = []
@@ -18,3 +19,8 @@ def splitTrainAndTestRandom(programFileName, frac_for_training):
     with open(programFileName+'_testing' + '_' + str(round(1-frac_for_training, 3))+'.txt', 'w', encoding='utf-8') as f3:
         for te in testing:
             f3.write(te)
+
+# same split for a dsl.ProgramTable, returning (training, testing) tables rather than writing files
+def splitTableRandom(table, frac_for_training):
+    training = np.array([random.random() <= frac_for_training for __ in range(len(table))], dtype=bool)
+    return table[training], table[~training]
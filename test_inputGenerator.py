@@ -0,0 +1,93 @@
+from collections import namedtuple
+import numpy as np
+import dsl
+import inputGenerator
+import z3InputsOracle
+
+Condition = namedtuple('Condition', ['notNull', 'behaviours', 'updateFeature'])
+
+# each example's specification is the one at its own index: an impossible feature gets dropped and counted
+# against that example alone, and a possible one after it is still applied
+def test_specifications_follow_examples(monkeypatch):
+    monkeypatch.setattr(inputGenerator, 'specStats', inputGenerator.SpecStats())
+    monkeypatch.setattr(inputGenerator, 'oraclePool', inputGenerator.OraclePool())
+    np.random.seed(0)
+    program = dsl.Program.fromString("{'I1': 'list'}\\FILTER,>0,I1")
+    generator = inputGenerator.IOGeneratorVaried(None, [], 3, 10, 5)
+    # FILTER >0 can't output anything below -50
+    specifications = [None, Condition(False, None, 'min'), Condition(False, None, 'max')]
+    results = generator.getExamplesfromZ3(program, 3, [], specifications, True)
+
+    counts = inputGenerator.specStats.getCounts()
+    assert counts[('FILTER,>0', 'min')] == (1, 1)
+    assert counts[('FILTER,>0', 'max')] == (1, 0)
+    # the unsat core drops 'min' rather than the query failing
+    assert results[1] is not None
+    allInputs, out = results[2]
+    assert max(out) > 50
+    for allInputs, out in results:
+        assert list(program.run(allInputs)) == out
+
+# a set solved in one query keeps the per-example path's exclusions: no two examples in it share an input value or an output
+def test_example_sets_distinct(monkeypatch):
+    monkeypatch.setattr(inputGenerator, 'oraclePool', inputGenerator.OraclePool())
+    np.random.seed(0)
+    program = dsl.Program.fromString("{'I1': 'list', 'I2': 'list'}\\ZIPWITH,MAX,I1 I2")
+    generator = inputGenerator.IOGeneratorConstraintBased(None, [], 6, 10, 3)
+    generator.z3ExampleSets = True
+    results = generator.getExamples(program)
+
+    assert generator.z3Stats['exampleSets'] == 2
+    assert len(results) == 6
+    for start in range(0, 6, 3):
+        exampleSet = results[start:start+3]
+        for i, (inputsA, outA) in enumerate(exampleSet):
+            assert list(program.run(inputsA)) == outA
+            for inputsB, outB in exampleSet[i+1:]:
+                assert outA != outB
+                assert not any(a == b for a in inputsA for b in inputsB)
+
+# the set oracle rules out one example reusing an input value of another, which distinct outputs alone allow
+def test_set_oracle_distinct_inputs():
+    program = dsl.Program.fromString("{'I1': 'list', 'I2': 'list'}\\ZIPWITH,MAX,I1 I2")
+    codifiedProgram = [(l.opcode,)+tuple(l.inputRefs) for l in program.lines]
+    for distinctInputs in [False, True]:
+        oracle = z3InputsOracle.z3ExampleSetOracle(10, 2)
+        oracle.setProgram(2, [], codifiedProgram, 'basic')
+        oracle.inputsNotNone()
+        oracle.distinctOutputs()
+        if distinctInputs:
+            oracle.distinctInputs()
+        a, b = oracle.copies
+        # second example's I1 is the first example's I2
+        oracle.beginAddConstraints()
+        oracle.solver.add(b.lineOutputLengths[-1] == a.lineOutputLengths[-2])
+        for k in range(10):
+            oracle.solver.add(b.lineOutputs[-1][k] == a.lineOutputs[-2][k])
+        assert (oracle.evalSatAndUpdateModel().removeAddedConstraints().getLastExamples() is None) == distinctInputs
+
+# an incremental oracle drops retired queries' constraints every maxQueriesPerSolver queries and keeps finding examples
+def test_incremental_oracle_rebuilt():
+    program = dsl.Program.fromString("{'I1': 'list'}\\SORT,,I1\\MAP,*2,X1")
+    codifiedProgram = [(l.opcode,)+tuple(l.inputRefs)+(None,) for l in program.lines]
+    oracle = z3InputsOracle.z3InputsOracle(10, incremental = True)
+    oracle.maxQueriesPerSolver = 3
+    oracle.setProgram(1, [], codifiedProgram, 'basic')
+    oracle.inputsNotNone()
+    programConstraints = len(oracle.solver.assertions())
+    for query in range(7):
+        oracle.beginAddConstraints()
+        oracle.setInputMinimumLengths({-1: 3})
+        res = oracle.evalSatAndUpdateModel().removeAddedConstraints().getLastInputsAndOutputs()
+        assert list(program.run([res[1]])) == res[0]
+        assert len(oracle.solver.assertions()) <= programConstraints + 2*oracle.maxQueriesPerSolver
+    assert len(oracle.solver.assertions()) == programConstraints + 2
+
+# z3Stats counted by pool workers end up in the generator run was called on
+def test_run_collects_worker_z3Stats(tmp_path):
+    programs = ["{'I1': 'list'}\\SORT,,I1", "{'I1': 'list'}\\REVERSE,,I1", "{'I1': 'list'}\\MAP,*2,I1", "{'I1': 'list'}\\FILTER,>0,I1"]
+    for method in ['run', 'runSharded']:
+        generator = inputGenerator.IOGeneratorConstraintBased(str(tmp_path / (method+'.txt')), programs, 2, 10, 2)
+        getattr(generator, method)(n_workers = 2, chunk_size = 1)
+        assert generator.z3Stats['programs'] == len(programs)
+        assert generator.z3Stats['encodeTime'] > 0
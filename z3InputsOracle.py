@@ -1,20 +1,106 @@
 from z3 import *
 import time
-from z3Interface import z3BaseOracle
+from collections import OrderedDict
+from z3Interface import makeTacticSolver, z3BaseOracle
+from dsl.components import registry
+
+# encodings of single lines, least recently used dropped first, see z3InputsOracle.setLineFromTemplate
+# keyed by (function, option, mode, max_list_length, is the output line, both inputs the same)
+lineTemplates = OrderedDict()
+lineTemplatesSize = 1024
+
+# the uninterpreted constants in an expression, visiting each shared subexpression once
+def getConstants(expression):
+    constants = []
+    seen = set()
+    todo = [expression]
+    while todo:
+        e = todo.pop()
+        if e.get_id() in seen:
+            continue
+        seen.add(e.get_id())
+        if is_const(e) and e.decl().kind() == Z3_OP_UNINTERPRETED:
+            constants.append(e)
+        else:
+            todo.extend(e.children())
+    return constants
+
+# stands in for setProgram's solver while a line template is recorded
+class ConstraintRecorder:
+    def __init__(self):
+        self.constraints = []
+
+    def add(self, *constraints):
+        self.constraints.extend(constraints)
 
 class z3InputsOracle(z3BaseOracle):
-    def __init__(self, max_list_length, timeout = None):
-        self.solver = Then(
-            'propagate-values',
-            'simplify',
-            'reduce-bv-size',
-            'solve-eqs',
-            'bit-blast',
-            'smt').solver()
+    # placeholder line numbers templates are encoded with, well clear of any real program's
+    templateLine = 9001
+    templateInputs = (9002, 9003)
+
+    # useTemplates encodes lines by substituting into cached line templates rather than building them in python each time
+    # valueBits and lengthBits are the bit-vector widths for values and list lengths. the default 32 bits leaves room to spare,
+    # narrower widths (down to 10 bits for values, see narrowLengthBits for lengths) give the bit-blaster far fewer clauses,
+    # with products and sums worked out wider so they can't wrap round into range. lengthBits defaults to valueBits at 32 bits
+    # and to the narrowest width that's safe otherwise
+    # namePrefix goes in front of every z3 variable name and solver is one to encode into instead of a new one,
+    # so several copies of a program can go in one query (see z3ExampleSetOracle)
+    # incremental guards each query with a selector literal rather than a push scope (see z3BaseOracle.incremental)
+    # and uses z3's incremental solver, where the tactic pipeline otherwise used starts from scratch on every check
+    def __init__(self, max_list_length, timeout = None, useTemplates = True, valueBits = 32, lengthBits = None, namePrefix = '', solver = None, incremental = False):
+        if lengthBits is None:
+            lengthBits = 32 if valueBits == 32 else z3InputsOracle.narrowLengthBits(max_list_length)
+        assert(valueBits >= 10)
+        assert(lengthBits >= z3InputsOracle.narrowLengthBits(max_list_length))
+        self.valueBits = valueBits
+        self.lengthBits = lengthBits
+        self.useTemplates = useTemplates
+        # seconds the last setProgram took
+        self.encodeTime = 0.0
+        self.namePrefix = namePrefix
+        self.incremental = incremental
+        if solver is None and incremental:
+            solver = Solver()
+        elif solver is None:
+            solver = makeTacticSolver()
+        self.solver = solver
+        self.optionals = {}
+        self.droppedOptionals = []
         if timeout is not None:
             self.setTimeout(timeout)
         self.max_list_length = max_list_length
 
+    # lengths and the index arithmetic on them run from -max_list_length to 2*max_list_length - 1,
+    # which this leaves clear of wrapping round onto a valid index
+    @staticmethod
+    def narrowLengthBits(max_list_length):
+        return max_list_length.bit_length() + 1
+
+    def varName(self, name):
+        return self.namePrefix + name
+
+    # a length (or index) as a value, for constraints that mix the two
+    def asValue(self, length):
+        if self.lengthBits == self.valueBits:
+            return length
+        return SignExt(self.valueBits - self.lengthBits, length)
+
+    # out == a*b, worked out at double width in a narrow encoding so the product can't wrap round
+    def isProduct(self, out, a, b):
+        if self.valueBits == 32:
+            return out == a * b
+        ext = self.valueBits
+        if is_bv(b):
+            b = SignExt(ext, b)
+        return SignExt(ext, out) == SignExt(ext, a) * b
+
+    # out == Sum(values), likewise worked out wide enough in a narrow encoding
+    def isSum(self, out, values):
+        if self.valueBits == 32:
+            return out == Sum(values)
+        ext = self.max_list_length.bit_length()
+        return SignExt(ext, out) == Sum([SignExt(ext, v) for v in values])
+
     def unsetProgram(self):
         self.solver.pop()
 
@@ -26,9 +112,10 @@ class z3InputsOracle(z3BaseOracle):
                 self.solver.add(self.lineOutputs[self.outputIndex][i] == output[i])
             self.solver.add(self.lineOutputLengths[self.outputIndex] == len(output))
 
-    # program lines is a list of tuples (func, opt, input1Id, input2Id)
+    # program lines is a list of tuples (func, opt, input1Id, input2Id) or (opcode, input1Id, input2Id)
     # mode is 'none', 'basic', 'varied'
     def setProgram(self, numberOfInputs, intInputs, programLines, mode):
+        startTime = time.time()
         self.numberOfLines = len(programLines)
         self.numberOfInputs = numberOfInputs
         self.outputIndex = self.numberOfLines - 1
@@ -41,9 +128,9 @@ class z3InputsOracle(z3BaseOracle):
             self.watchedPreds = []
 
         for i in range(self.numberOfLines + self.numberOfInputs):
-            self.lineOutputs.append(self.BitVectorVector('line'+str(i)+'Outputs', self.max_list_length))
+            self.lineOutputs.append(self.BitVectorVector(self.varName('line'+str(i)+'Outputs'), self.max_list_length, self.valueBits))
             self.solver.add(self.bound_intvector(self.lineOutputs[i]))
-            self.lineOutputLengths.append(BitVec('line'+str(i)+'OutLength', 32))
+            self.lineOutputLengths.append(BitVec(self.varName('line'+str(i)+'OutLength'), self.lengthBits))
             self.solver.add(self.bound_int(self.lineOutputLengths[i], 0, self.max_list_length))
 
         # integer inputs are only useful for referencing list indices
@@ -55,13 +142,88 @@ class z3InputsOracle(z3BaseOracle):
                 temp_preds = []
                 tp_2 = []
                 for j in range(5):
-                    name = 'p_'+str(i)+'_'+str(j)
+                    name = self.varName('p_'+str(i)+'_'+str(j))
                     temp_preds.append(Bool(name))
                     tp_2.append(Bool(name+'_watched'))
                     # self.linePreds[i][j] = Bool(name)
                 self.linePreds.append(temp_preds)
                 self.watchedPreds.append(tp_2)
-            self.setLine(i, line[0], line[1], line[2], line[3])
+            if isinstance(line[0], int):
+                line = (registry.functionIds[line[0]], registry.optionIds[line[0]]) + tuple(line[1:])
+            if self.useTemplates:
+                self.setLineFromTemplate(i, line[0], line[1], line[2], line[3])
+            else:
+                self.setLine(i, line[0], line[1], line[2], line[3])
+        self.encodeTime = time.time() - startTime
+
+    # adds the same constraints as setLine, by substituting this program's variables into a cached encoding
+    # of a line with the same function and shape, so a line type is only built up in python once per process
+    def setLineFromTemplate(self, lineNumber, lineFunction, lineOption, input1lineNumber, input2lineNumber):
+        isOutput = lineNumber == self.outputIndex
+        sameInputs = input1lineNumber == input2lineNumber
+        key = (lineFunction, lineOption, self.mode, self.max_list_length, self.valueBits, self.lengthBits, isOutput, sameInputs)
+        template = lineTemplates.get(key)
+        if template is None:
+            template = self.makeLineTemplate(lineFunction, lineOption, isOutput, sameInputs)
+            lineTemplates[key] = template
+            if len(lineTemplates) > lineTemplatesSize:
+                lineTemplates.popitem(last = False)
+        else:
+            lineTemplates.move_to_end(key)
+        constraint, placeholders = template
+
+        refs = {self.templateLine: lineNumber, self.templateInputs[0]: input1lineNumber, self.templateInputs[1]: input2lineNumber}
+        pairs = []
+        for placeholder, kind, ref, detail in placeholders:
+            if kind == 'outputs':
+                pairs.append((placeholder, self.lineOutputs[refs[ref]][detail]))
+            elif kind == 'length':
+                pairs.append((placeholder, self.lineOutputLengths[refs[ref]]))
+            else:
+                # a variable the line made for itself, named after the line numbers involved
+                name = detail
+                for templateRef, actualRef in refs.items():
+                    name = name.replace(str(templateRef), str(actualRef))
+                pairs.append((placeholder, Const(self.varName(name), placeholder.sort())))
+        self.solver.add(substitute(constraint, *pairs))
+
+    # runs setLine on placeholder lines, recording what it adds as one constraint
+    # along with (placeholder, kind, template line, index or name) for each variable in it
+    def makeLineTemplate(self, lineFunction, lineOption, isOutput, sameInputs):
+        recorder = z3InputsOracle.__new__(z3InputsOracle)
+        recorder.max_list_length = self.max_list_length
+        recorder.valueBits = self.valueBits
+        recorder.lengthBits = self.lengthBits
+        recorder.namePrefix = ''
+        recorder.mode = self.mode
+        recorder.solver = ConstraintRecorder()
+        line = self.templateLine
+        input1, input2 = self.templateInputs
+        if sameInputs:
+            input2 = input1
+        recorder.outputIndex = line if isOutput else None
+        recorder.lineOutputs = {}
+        recorder.lineOutputLengths = {}
+        for ref in (line, input1, input2):
+            recorder.lineOutputs[ref] = self.BitVectorVector('line'+str(ref)+'Outputs', self.max_list_length, self.valueBits)
+            recorder.lineOutputLengths[ref] = BitVec('line'+str(ref)+'OutLength', self.lengthBits)
+        if self.mode == 'varied':
+            name = 'p_'+str(line)+'_'
+            recorder.linePreds = {line: [Bool(name+str(j)) for j in range(5)]}
+            recorder.watchedPreds = {line: [Bool(name+str(j)+'_watched') for j in range(5)]}
+        recorder.setLine(line, lineFunction, lineOption, input1, input2)
+        constraint = And(*recorder.solver.constraints)
+
+        slots = {}
+        for ref in (line, input1, input2):
+            slots[recorder.lineOutputLengths[ref].get_id()] = ('length', ref, None)
+            for k, v in enumerate(recorder.lineOutputs[ref]):
+                slots[v.get_id()] = ('outputs', ref, k)
+        placeholders = []
+        for v in getConstants(constraint):
+            kind, ref, detail = slots.get(v.get_id(), ('named', None, str(v)))
+            placeholders.append((v, kind, ref, detail))
+        return constraint, placeholders
 
     def setLine(self, lineNumber, lineFunction, lineOption, input1lineNumber, input2lineNumber):
         if lineFunction == 'MAP':
@@ -184,8 +346,8 @@ class z3InputsOracle(z3BaseOracle):
 
     def setMaxCanVary(self, lineNumber, input1lineNumber):
         if self.mode == 'varied':
-            local_max_out = BitVec('line'+str(lineNumber)+'max', 32)
-            local_max_in = BitVec('line'+str(input1lineNumber)+'max', 32)
+            local_max_out = BitVec(self.varName('line'+str(lineNumber)+'max'), self.valueBits)
+            local_max_in = BitVec(self.varName('line'+str(input1lineNumber)+'max'), self.valueBits)
             self.solver.add(self.bound_int(local_max_out))
             self.solver.add(self.bound_int(local_max_in))
             eqCons = []
@@ -225,8 +387,8 @@ class z3InputsOracle(z3BaseOracle):
 
     def setMinCanVary(self, lineNumber, input1lineNumber):
         if self.mode == 'varied':
-            local_min_out = BitVec('line'+str(lineNumber)+'min', 32)
-            local_min_in = BitVec('line'+str(input1lineNumber)+'min', 32)
+            local_min_out = BitVec(self.varName('line'+str(lineNumber)+'min'), self.valueBits)
+            local_min_in = BitVec(self.varName('line'+str(input1lineNumber)+'min'), self.valueBits)
             self.solver.add(self.bound_int(local_min_out))
             self.solver.add(self.bound_int(local_min_in))
             eqCons = []
@@ -304,7 +466,7 @@ class z3InputsOracle(z3BaseOracle):
             for k in range(self.max_list_length):
                 self.solver.add(Implies(
                     k < self.lineOutputLengths[input1lineNumber],
-                    self.lineOutputs[lineNumber][k] == self.lineOutputs[input1lineNumber][k] * 2
+                    self.isProduct(self.lineOutputs[lineNumber][k], self.lineOutputs[input1lineNumber][k], 2)
                 ))
             # change of values depends on whether they were zero at input
             self.setHeadIsFixed(lineNumber)
@@ -339,7 +501,7 @@ class z3InputsOracle(z3BaseOracle):
             for k in range(self.max_list_length):
                 self.solver.add(Implies(
                     k < self.lineOutputLengths[input1lineNumber],
-                    self.lineOutputs[lineNumber][k] == self.lineOutputs[input1lineNumber][k] * 3
+                    self.isProduct(self.lineOutputs[lineNumber][k], self.lineOutputs[input1lineNumber][k], 3)
                 ))
             self.setHeadIsFixed(lineNumber)
             self.setTailIsFixed(lineNumber)
@@ -373,7 +535,7 @@ class z3InputsOracle(z3BaseOracle):
             for k in range(self.max_list_length):
                 self.solver.add(Implies(
                     k < self.lineOutputLengths[input1lineNumber],
-                    self.lineOutputs[lineNumber][k] == self.lineOutputs[input1lineNumber][k] * 4
+                    self.isProduct(self.lineOutputs[lineNumber][k], self.lineOutputs[input1lineNumber][k], 4)
                 ))
             self.setHeadIsFixed(lineNumber)
             self.setTailIsFixed(lineNumber)
@@ -407,7 +569,7 @@ class z3InputsOracle(z3BaseOracle):
             for k in range(self.max_list_length):
                 self.solver.add(Implies(
                     k < self.lineOutputLengths[input1lineNumber],
-                    self.lineOutputs[lineNumber][k] == self.lineOutputs[input1lineNumber][k] * self.lineOutputs[input1lineNumber][k]
+                    self.isProduct(self.lineOutputs[lineNumber][k], self.lineOutputs[input1lineNumber][k], self.lineOutputs[input1lineNumber][k])
                 ))
             self.setHeadIsFixed(lineNumber)
             self.setTailIsFixed(lineNumber)
@@ -452,7 +614,7 @@ class z3InputsOracle(z3BaseOracle):
             for k in range(self.max_list_length):
                 self.solver.add(Implies(
                     k < self.lineOutputLengths[lineNumber],
-                    self.lineOutputs[lineNumber][k] == self.lineOutputs[input1lineNumber][k] * self.lineOutputs[input2lineNumber][k]
+                    self.isProduct(self.lineOutputs[lineNumber][k], self.lineOutputs[input1lineNumber][k], self.lineOutputs[input2lineNumber][k])
                 ))
         elif lineOption == '-':
             for k in range(self.max_list_length):
@@ -507,7 +669,7 @@ class z3InputsOracle(z3BaseOracle):
             for k in range(1, self.max_list_length):
                 self.solver.add(Implies(
                     k < self.lineOutputLengths[input1lineNumber],
-                    self.lineOutputs[lineNumber][k] == self.lineOutputs[lineNumber][k-1] * self.lineOutputs[input1lineNumber][k]
+                    self.isProduct(self.lineOutputs[lineNumber][k], self.lineOutputs[lineNumber][k-1], self.lineOutputs[input1lineNumber][k])
                 ))
             self.setMaxCanVary(lineNumber, input1lineNumber)
             self.setMinCanVary(lineNumber, input1lineNumber)
@@ -595,9 +757,9 @@ class z3InputsOracle(z3BaseOracle):
         self.setMaxIsFixed(lineNumber)
         self.setMinIsFixed(lineNumber)
 
-        filterMap = self.BitVectorVector('filterMap_'+str(lineNumber), self.max_list_length)
+        filterMap = self.BitVectorVector(self.varName('filterMap_'+str(lineNumber)), self.max_list_length, self.lengthBits)
         self.solver.add(self.bound_intvector(filterMap, 0, self.max_list_length))
-        filterCount = self.BitVectorVector('filterCount_'+str(lineNumber), self.max_list_length)
+        filterCount = self.BitVectorVector(self.varName('filterCount_'+str(lineNumber)), self.max_list_length, self.lengthBits)
         self.solver.add(self.bound_intvector(filterCount, 0, 1))
 
         self.solver.add(self.lineOutputLengths[lineNumber] == Sum(filterCount))
@@ -692,11 +854,11 @@ class z3InputsOracle(z3BaseOracle):
         self.setTailCanVary(lineNumber, input1lineNumber)
         self.setMaxIsFixed(lineNumber)
         self.setMinIsFixed(lineNumber)
-        filterCount = self.BitVectorVector('filterCount_'+str(lineNumber), self.max_list_length)
+        filterCount = self.BitVectorVector(self.varName('filterCount_'+str(lineNumber)), self.max_list_length, self.lengthBits)
         self.solver.add(self.bound_intvector(filterCount, 0, 1))
 
         self.solver.add(self.lineOutputLengths[lineNumber] == 1)
-        self.solver.add(self.lineOutputs[lineNumber][0] == Sum(filterCount))
+        self.solver.add(self.lineOutputs[lineNumber][0] == self.asValue(Sum(filterCount)))
 
         if lineOption == '<0':
             for k in range(self.max_list_length):
@@ -778,7 +940,7 @@ class z3InputsOracle(z3BaseOracle):
         self.setMinIsFixed(lineNumber)
         # "sortMap[k] = l" means that position k of input goes to position l of output
         # want this map to be a bijection within the active range of the list i.e. for k < inputlength[i]
-        self.sortMap = self.BitVectorVector('sortMap_'+str(lineNumber), self.max_list_length)
+        self.sortMap = self.BitVectorVector(self.varName('sortMap_'+str(lineNumber)), self.max_list_length, self.lengthBits)
         self.solver.add(self.bound_intvector(self.sortMap, 0, self.max_list_length))
         self.solver.add(self.lineOutputLengths[lineNumber] == self.lineOutputLengths[input1lineNumber])
 
@@ -877,7 +1039,7 @@ class z3InputsOracle(z3BaseOracle):
         self.setTailCanVary(lineNumber, input1lineNumber)
         self.setMaxIsFixed(lineNumber)
         self.setMinIsFixed(lineNumber)
-        self.solver.add(self.lineOutputs[lineNumber][0] == Sum(self.lineOutputs[input1lineNumber]))
+        self.solver.add(self.isSum(self.lineOutputs[lineNumber][0], self.lineOutputs[input1lineNumber]))
         self.solver.add(self.lineOutputLengths[lineNumber] == 1)
 
         for k in range(self.max_list_length):
@@ -903,10 +1065,10 @@ class z3InputsOracle(z3BaseOracle):
             ),
             And(
                 self.lineOutputLengths[lineNumber] <= self.lineOutputLengths[input2lineNumber],
-                self.lineOutputLengths[lineNumber] <= self.lineOutputs[input1lineNumber][0],
+                self.asValue(self.lineOutputLengths[lineNumber]) <= self.lineOutputs[input1lineNumber][0],
                 Or(
                     self.lineOutputLengths[lineNumber] == self.lineOutputLengths[input2lineNumber],
-                    self.lineOutputLengths[lineNumber] == self.lineOutputs[input1lineNumber][0],
+                    self.asValue(self.lineOutputLengths[lineNumber]) == self.lineOutputs[input1lineNumber][0],
                 )
             )
         ))
@@ -917,10 +1079,10 @@ class z3InputsOracle(z3BaseOracle):
             ),
             And(
                 self.lineOutputLengths[lineNumber] <= self.lineOutputLengths[input2lineNumber],
-                self.lineOutputLengths[lineNumber] <= self.lineOutputLengths[input2lineNumber] + self.lineOutputs[input1lineNumber][0],
+                self.asValue(self.lineOutputLengths[lineNumber]) <= self.asValue(self.lineOutputLengths[input2lineNumber]) + self.lineOutputs[input1lineNumber][0],
                 Or(
                     self.lineOutputLengths[lineNumber] == self.lineOutputLengths[input2lineNumber],
-                    self.lineOutputLengths[lineNumber] == self.lineOutputLengths[input2lineNumber] + self.lineOutputs[input1lineNumber][0]
+                    self.asValue(self.lineOutputLengths[lineNumber]) == self.asValue(self.lineOutputLengths[input2lineNumber]) + self.lineOutputs[input1lineNumber][0]
                 )
             )
         ))
@@ -942,7 +1104,7 @@ class z3InputsOracle(z3BaseOracle):
                 And(
                     self.lineOutputLengths[input1lineNumber] == 1,
                     self.lineOutputs[input1lineNumber][0] < 0,
-                    k < self.lineOutputLengths[input2lineNumber] + self.lineOutputs[input1lineNumber][0]
+                    k < self.asValue(self.lineOutputLengths[input2lineNumber]) + self.lineOutputs[input1lineNumber][0]
                 ),
                 self.lineOutputs[lineNumber][k] == self.lineOutputs[input2lineNumber][k]
             ))
@@ -967,9 +1129,9 @@ class z3InputsOracle(z3BaseOracle):
                 self.lineOutputs[input1lineNumber][0] >= 0
             ),
             And(
-                self.lineOutputLengths[lineNumber] >= self.lineOutputLengths[input2lineNumber] - self.lineOutputs[input1lineNumber][0],
+                self.asValue(self.lineOutputLengths[lineNumber]) >= self.asValue(self.lineOutputLengths[input2lineNumber]) - self.lineOutputs[input1lineNumber][0],
                 Or(
-                    self.lineOutputLengths[lineNumber] == self.lineOutputLengths[input2lineNumber] - self.lineOutputs[input1lineNumber][0],
+                    self.asValue(self.lineOutputLengths[lineNumber]) == self.asValue(self.lineOutputLengths[input2lineNumber]) - self.lineOutputs[input1lineNumber][0],
                     self.lineOutputLengths[lineNumber] == 0
                 )
             )
@@ -980,10 +1142,10 @@ class z3InputsOracle(z3BaseOracle):
                 self.lineOutputs[input1lineNumber][0] < 0
             ),
             And(
-                self.lineOutputLengths[lineNumber] <= -self.lineOutputs[input1lineNumber][0],
+                self.asValue(self.lineOutputLengths[lineNumber]) <= -self.lineOutputs[input1lineNumber][0],
                 self.lineOutputLengths[lineNumber] <= self.lineOutputLengths[input2lineNumber],
                 Or(
-                    self.lineOutputLengths[lineNumber] == -self.lineOutputs[input1lineNumber][0],
+                    self.asValue(self.lineOutputLengths[lineNumber]) == -self.lineOutputs[input1lineNumber][0],
                     self.lineOutputLengths[lineNumber] == self.lineOutputLengths[input2lineNumber]
                 )
             )
@@ -1007,16 +1169,16 @@ class z3InputsOracle(z3BaseOracle):
         self.solver.add(Or(self.lineOutputLengths[input1lineNumber] == 0, self.lineOutputLengths[input1lineNumber] == 1))
         self.solver.add(Implies(
             Or(
-                self.lineOutputs[input1lineNumber][0] < -self.lineOutputLengths[input2lineNumber],
-                self.lineOutputs[input1lineNumber][0] >= self.lineOutputLengths[input2lineNumber],
+                self.lineOutputs[input1lineNumber][0] < -self.asValue(self.lineOutputLengths[input2lineNumber]),
+                self.lineOutputs[input1lineNumber][0] >= self.asValue(self.lineOutputLengths[input2lineNumber]),
                 self.lineOutputLengths[input1lineNumber] == 0
             ),
             self.lineOutputLengths[lineNumber] == 0
         ))
         self.solver.add(Implies(
             And(
-                self.lineOutputs[input1lineNumber][0] >= -self.lineOutputLengths[input2lineNumber],
-                self.lineOutputs[input1lineNumber][0] < self.lineOutputLengths[input2lineNumber],
+                self.lineOutputs[input1lineNumber][0] >= -self.asValue(self.lineOutputLengths[input2lineNumber]),
+                self.lineOutputs[input1lineNumber][0] < self.asValue(self.lineOutputLengths[input2lineNumber]),
                 self.lineOutputLengths[input1lineNumber] == 1
             ),
             self.lineOutputLengths[lineNumber] == 1
@@ -1026,7 +1188,7 @@ class z3InputsOracle(z3BaseOracle):
                 And(
                     self.lineOutputLengths[input1lineNumber] == 1,
                     self.lineOutputs[input1lineNumber][0] >= 0,
-                    self.lineOutputs[input1lineNumber][0] < self.lineOutputLengths[input2lineNumber],
+                    self.lineOutputs[input1lineNumber][0] < self.asValue(self.lineOutputLengths[input2lineNumber]),
                     k == self.lineOutputs[input1lineNumber][0]
                 ),
                 self.lineOutputs[lineNumber][0] == self.lineOutputs[input2lineNumber][k],
@@ -1034,11 +1196,11 @@ class z3InputsOracle(z3BaseOracle):
             self.solver.add(Implies(
                 And(
                     self.lineOutputLengths[input1lineNumber] == 1,
-                    k == self.lineOutputLengths[input2lineNumber] + self.lineOutputs[input1lineNumber][0],
+                    k == self.asValue(self.lineOutputLengths[input2lineNumber]) + self.lineOutputs[input1lineNumber][0],
                     self.lineOutputs[input1lineNumber][0] < 0,
-                    self.lineOutputs[input1lineNumber][0] >= -self.lineOutputLengths[input2lineNumber]
+                    self.lineOutputs[input1lineNumber][0] >= -self.asValue(self.lineOutputLengths[input2lineNumber])
                 ),
-                self.getElement(self.lineOutputs[lineNumber][0], self.lineOutputs[input2lineNumber], self.lineOutputLengths[input2lineNumber] + self.lineOutputs[input1lineNumber][0])
+                self.getElement(self.lineOutputs[lineNumber][0], self.lineOutputs[input2lineNumber], self.asValue(self.lineOutputLengths[input2lineNumber]) + self.lineOutputs[input1lineNumber][0])
             ))
         # output is an integer, integers are only useful within he length of the lists, unless it's the output
         if lineNumber != self.outputIndex:
@@ -1067,8 +1229,8 @@ class z3InputsOracle(z3BaseOracle):
             self.solver.add(self.lineOutputLengths[j] <= length)
         return self
 
-    def setOutputMinimumLength(self, length):
-        self.solver.add(self.lineOutputLengths[self.outputIndex] >= length)
+    def setOutputMinimumLength(self, length, optional = None):
+        self.addOptional(optional, self.lineOutputLengths[self.outputIndex] >= length)
 
     def setOutputNoZero(self):
         cons = []
@@ -1138,30 +1300,32 @@ class z3InputsOracle(z3BaseOracle):
             ind += -1
         return And(*andCons)
 
-    def excludeOutputs(self, example):
-        self.solver.add(self.excludeValueConstraint(self.outputIndex, example))
+    def excludeOutputs(self, example, optional = None):
+        self.addOptional(optional, self.excludeValueConstraint(self.outputIndex, example))
+
+    # no input takes the value value
+    def excludeInputs(self, value, optional = None):
+        self.addOptional(optional, self.excludeInputConstraint(value))
 
     # force output to contain at least one value greater than val
-    def setOutMax(self, val):
+    def setOutMax(self, val, optional = None):
         cons = []
         for i in range(self.max_list_length):
             cons.append(And(
                 self.lineOutputs[self.outputIndex][i] > val,
                 self.lineOutputLengths[self.outputIndex] > i
             ))
-        s = self.solver
-        s.add(Or(*cons))
+        self.addOptional(optional, Or(*cons))
 
     # force output to contain at least one value less than val
-    def setOutMin(self, val):
+    def setOutMin(self, val, optional = None):
         cons = []
         for i in range(self.max_list_length):
             cons.append(And(
                 self.lineOutputs[self.outputIndex][i] < val,
                 self.lineOutputLengths[self.outputIndex] > i
             ))
-        s = self.solver
-        s.add(Or(*cons))
+        self.addOptional(optional, Or(*cons))
 
     # all elements of selected inputs (typically the list inputs) should be larger than val
     def setInputsMinAbsValue(self, val, whichInputs):
@@ -1177,7 +1341,7 @@ class z3InputsOracle(z3BaseOracle):
     # want to exclude these exact combinations to encourage meaningfully different examples
     # it's a bit grim to rely on the meaning implicit in the order of the list. Sorry.
     # if this starts behaving wierdly, compare ordering in linePreds and in Program.compareLines
-    def excludeBehaviours(self, behaviours):
+    def excludeBehaviours(self, behaviours, optional = None):
         for b in behaviours:
             # difference only required in *some* line, not all
             or_cons = []
@@ -1188,19 +1352,19 @@ class z3InputsOracle(z3BaseOracle):
                     # some value has to be opposite to previous
                     # and it must be a characteristic we're interested in
                     or_cons.append(And(self.linePreds[i][j] != value, self.watchedPreds[i][j] == True))
-            self.solver.add(Or(*or_cons))
+            self.addOptional(optional, Or(*or_cons))
 
     # to ensure each line does something "interesting"
     # can vary what is considered interesting by
     #  set---CanVary / set---IsFixed in definition of dsl functions above
-    def excludeNullBehaviours(self):
+    def excludeNullBehaviours(self, optional = None):
         for i in range(self.numberOfLines):
             # null behaviour forbidden for *every* line, not just one
             line_cons = []
             # 5 == number of watched predicates
             for j in range(5):
                 line_cons.append(And(self.linePreds[i][j] == True, self.watchedPreds[i][j] == True))
-            self.solver.add(Or(*line_cons))
+            self.addOptional(optional, Or(*line_cons))
 
     def getLastInputsAndOutputs(self):
         if self.isSat == sat:
@@ -1209,25 +1373,116 @@ class z3InputsOracle(z3BaseOracle):
             ind = -1
             for __ in range(self.numberOfInputs):
                 thisInput = []
-                length = z3InputsOracle.fixValue(self.currModel[self.lineOutputLengths[ind]].as_long())
+                length = z3InputsOracle.fixValue(self.currModel[self.lineOutputLengths[ind]].as_long(), self.lengthBits)
                 for k in range(length):
-                    nextVal = z3InputsOracle.fixValue(self.currModel[self.lineOutputs[ind][k]].as_long())
+                    nextVal = z3InputsOracle.fixValue(self.currModel[self.lineOutputs[ind][k]].as_long(), self.valueBits)
                     thisInput.append(nextVal)
                 allInputs.append(thisInput)
                 ind += -1
             allInputs.reverse()
 
-            outputLength = z3InputsOracle.fixValue(self.currModel[self.lineOutputLengths[self.outputIndex]].as_long())
+            outputLength = z3InputsOracle.fixValue(self.currModel[self.lineOutputLengths[self.outputIndex]].as_long(), self.lengthBits)
             for k in range(outputLength):
-                nextVal = z3InputsOracle.fixValue(self.currModel[self.lineOutputs[self.outputIndex][k]].as_long())
+                nextVal = z3InputsOracle.fixValue(self.currModel[self.lineOutputs[self.outputIndex][k]].as_long(), self.valueBits)
                 output.append(nextVal)
 
             result = [output]
             result.extend(allInputs)
             return result
 
+    # a model value read back as a signed int, given the width of its bit-vector
     @staticmethod
-    def fixValue(val):
+    def fixValue(val, bits = 32):
         if val > 256:
-            return -(2**32 - val)
+            return -(2**bits - val)
         return val
+
+# copies of one program encoded side by side in a single query, so a whole example set comes out of one model
+# copy c is a z3InputsOracle with its variables named 'e<c>_...', all encoding into the same solver.
+# constraints for a single example go on the copy (oracle.copies[c]), ones between examples on this
+class z3ExampleSetOracle(z3BaseOracle):
+    def __init__(self, max_list_length, copies, timeout = None, useTemplates = True, valueBits = 32, lengthBits = None, incremental = False):
+        assert(copies >= 1)
+        first = z3InputsOracle(max_list_length, timeout, useTemplates, valueBits, lengthBits, 'e0_', incremental = incremental)
+        self.solver = first.solver
+        self.timeout = timeout
+        self.incremental = incremental
+        self.copies = [first]
+        for c in range(1, copies):
+            self.copies.append(z3InputsOracle(max_list_length, None, useTemplates, valueBits, lengthBits, 'e'+str(c)+'_', self.solver, incremental))
+        self.max_list_length = max_list_length
+        self.encodeTime = 0.0
+        self.optionals = {}
+        self.droppedOptionals = []
+
+    def setProgram(self, numberOfInputs, intInputs, programLines, mode):
+        self.mode = mode
+        for copy in self.copies:
+            copy.setProgram(numberOfInputs, intInputs, programLines, mode)
+        self.encodeTime = sum(copy.encodeTime for copy in self.copies)
+
+    def unsetProgram(self):
+        for copy in self.copies:
+            copy.unsetProgram()
+
+    # the copies add a query's constraints through this oracle's solver, which is a SelectedSolver in incremental mode
+    def beginAddConstraints(self):
+        z3BaseOracle.beginAddConstraints(self)
+        for copy in self.copies:
+            copy.solver = self.solver
+        return self
+
+    def removeAddedConstraints(self):
+        z3BaseOracle.removeAddedConstraints(self)
+        for copy in self.copies:
+            copy.solver = self.solver
+        return self
+
+    def inputsNotNone(self):
+        for copy in self.copies:
+            copy.inputsNotNone()
+        return self
+
+    def outputNotNone(self):
+        for copy in self.copies:
+            copy.outputNotNone()
+        return self
+
+    def distinctInandOut(self):
+        for copy in self.copies:
+            copy.distinctInandOut()
+
+    # line indexA of copy a and line indexB of copy b give different values
+    def valuesDiffer(self, a, indexA, b, indexB):
+        outA, outB = a.lineOutputs[indexA], b.lineOutputs[indexB]
+        lengthA, lengthB = a.lineOutputLengths[indexA], b.lineOutputLengths[indexB]
+        cons = [lengthA != lengthB]
+        for k in range(self.max_list_length):
+            cons.append(And(k < lengthA, outA[k] != outB[k]))
+        return Or(*cons)
+
+    # no two examples with the same output (so no two with the same inputs either)
+    def distinctOutputs(self):
+        for i, a in enumerate(self.copies):
+            for b in self.copies[i+1:]:
+                self.solver.add(self.valuesDiffer(a, a.outputIndex, b, b.outputIndex))
+
+    # no input of an example takes the value of any input of another, as getExamplesfromZ3's noRepeatedIn asks of
+    # each example against the earlier ones in its set
+    def distinctInputs(self):
+        for i, a in enumerate(self.copies):
+            for b in self.copies[i+1:]:
+                for j in range(a.numberOfInputs):
+                    for k in range(b.numberOfInputs):
+                        self.solver.add(self.valuesDiffer(a, -(j+1), b, -(k+1)))
+
+    # one result per copy, each in the form z3InputsOracle.getLastInputsAndOutputs gives, or None if the query wasn't satisfied
+    def getLastExamples(self):
+        if self.isSat != sat:
+            return None
+        results = []
+        for copy in self.copies:
+            copy.isSat = self.isSat
+            copy.currModel = self.currModel
+            results.append(copy.getLastInputsAndOutputs())
+        return results
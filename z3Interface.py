@@ -1,5 +1,30 @@
 from z3 import *
 
+# the solver oracles use unless they're incremental: a pipeline of tactics ending in bit-blasting,
+# which starts from scratch on every check
+def makeTacticSolver():
+    return Then(
+        'propagate-values',
+        'simplify',
+        'reduce-bv-size',
+        'solve-eqs',
+        'bit-blast',
+        'smt').solver()
+
+# stands in for an incremental oracle's solver between beginAddConstraints and removeAddedConstraints,
+# adding constraints under the query's selector literal rather than in a push scope. anything else goes to the solver
+class SelectedSolver:
+    def __init__(self, solver, selector):
+        self.solver = solver
+        self.selector = selector
+
+    def add(self, *constraints):
+        for c in constraints:
+            self.solver.add(Implies(self.selector, c))
+
+    def __getattr__(self, name):
+        return getattr(self.solver, name)
+
 class z3BaseOracle:
     class AvailableFunctions:
         MapMinus1 = 0
@@ -41,11 +66,29 @@ class z3BaseOracle:
         ZipMult = 36
         ScanMult = 37
 
+    # solver timeout in ms, if one's been set
+    timeout = None
+    # longest getUnsatCore spends looking for a core, in ms, if there's no timeout
+    coreTimeout = 2000
+
+    # with incremental set, the constraints of a query (between beginAddConstraints and removeAddedConstraints)
+    # are guarded by a fresh selector literal that's assumed when checking and then turned off for good,
+    # instead of going in a push scope, so what the solver has learnt about the program carries over to the next query
+    incremental = False
+    # selector literals used so far
+    selectors = 0
+    # a retired query's constraints stay in the solver, switched off by Not(selector), so an incremental oracle
+    # gets a fresh solver holding only the constraints from outside queries after this many queries
+    maxQueriesPerSolver = 200
+    # queries since the solver was last rebuilt
+    queriesOnSolver = 0
+
     def __init__(self):
         pass
 
     def setTimeout(self, timeoutms):
         self.solver.set("timeout", timeoutms)
+        self.timeout = timeoutms
 
     def bound_int(self, intvar, lw=-255, ub=255):
         # Returns a constraint bounding the domain of intvar
@@ -69,29 +112,120 @@ class z3BaseOracle:
 
     def beginAddConstraints(self):
         s = self.solver
-        s.push()
+        if self.incremental:
+            self.selectors += 1
+            self.solver = SelectedSolver(s, Bool('query_'+str(self.selectors)))
+        else:
+            s.push()
+        self.optionals = {}
         return self
 
     def removeAddedConstraints(self):
         s = self.solver
-        s.pop()
+        if self.incremental:
+            self.solver = s.solver
+            self.solver.add(Not(s.selector))
+            self.queriesOnSolver += 1
+            if self.queriesOnSolver >= self.maxQueriesPerSolver:
+                self.rebuildSolver()
+        else:
+            s.pop()
+        self.optionals = {}
         return self
 
+    # replaces an incremental oracle's solver with a new one without any query's constraints or retired selectors
+    def rebuildSolver(self):
+        def isSelector(e):
+            return is_const(e) and e.decl().name().startswith('query_')
+        solver = Solver()
+        if self.timeout is not None:
+            solver.set("timeout", self.timeout)
+        # as many scopes as before, so unsetProgram still has setProgram's to pop (with everything in it)
+        for __ in range(self.solver.num_scopes()):
+            solver.push()
+        for a in self.solver.assertions():
+            if not ((is_implies(a) or is_not(a)) and isSelector(a.arg(0))):
+                solver.add(a)
+        self.solver = solver
+        self.queriesOnSolver = 0
+
+    # literals a check has to assume: the query's selector in incremental mode
+    def getAssumptions(self):
+        if isinstance(self.solver, SelectedSolver):
+            return [self.solver.selector]
+        return []
+
+    # constraints the query can do without, all under one literal per name that evalSatAndUpdateModel assumes,
+    # so an unsat core says which of them are in conflict. name None adds them as ordinary constraints
+    # call between beginAddConstraints and removeAddedConstraints
+    def addOptional(self, name, *constraints):
+        if name is None:
+            self.solver.add(*constraints)
+            return
+        literal = self.optionals.get(name)
+        if literal is None:
+            literal = Bool('optional_'+name)
+            self.optionals[name] = literal
+        for c in constraints:
+            self.solver.add(Implies(literal, c))
+
     def prepareDataTypesEnum(self):
         self.VarTypes = self.VarTypesClass()
 
+    # checks the solver under assumptions. z3's incremental solver gives up on some queries the tactic pipeline manages,
+    # so in incremental mode one that times out is tried again from scratch on a tactic solver, and lastSolver is the one that answered
+    def check(self, assumptions):
+        self.lastSolver = self.solver
+        result = self.solver.check(*assumptions)
+        if result == unknown and self.incremental:
+            fallback = makeTacticSolver()
+            if self.timeout is not None:
+                fallback.set("timeout", self.timeout)
+            fallback.add(*self.solver.assertions())
+            self.lastSolver = fallback
+            result = fallback.check(*assumptions)
+        return result
+
     def checkSat(self):
-        if self.solver.check() == unsat:
+        result = self.check(self.getAssumptions())
+        if result == unsat:
             return -1
-        if self.solver.check() == sat:
+        if result == sat:
             return 1
         return 0
 
+    # literals among assumptions that the solver's constraints can't all be satisfied with.
+    # oracle solvers are built from tactics that can't give unsat cores (reduce-bv-size),
+    # so this goes to a plain bit-vector solver, which only has to run when a query with optional constraints fails.
+    # [] if it can't find one in time
+    def getUnsatCore(self, assumptions):
+        coreSolver = SolverFor('QF_BV')
+        coreSolver.set(unsat_core = True)
+        coreSolver.set("timeout", self.timeout if self.timeout is not None else self.coreTimeout)
+        coreSolver.add(*self.solver.assertions())
+        if coreSolver.check(*assumptions) != unsat:
+            return []
+        return coreSolver.unsat_core()
+
+    # a check with optional constraints that's unsat (or times out, when the core solver may still show it's unsat)
+    # is tried again without the ones in the unsat core, until it's satisfied or there's no core holding any of them.
+    # droppedOptionals lists the names that had to go
     def evalSatAndUpdateModel(self):
-        s = self.solver
-        self.isSat = s.check()
+        selected = self.getAssumptions()
+        assumed = dict(self.optionals)
+        self.droppedOptionals = []
+        self.isSat = self.check(selected + list(assumed.values()))
+        while self.isSat != sat and assumed:
+            core = set(str(literal) for literal in self.getUnsatCore(selected + list(assumed.values())))
+            blamed = [name for name, literal in assumed.items() if str(literal) in core]
+            if not blamed:
+                break
+            for name in blamed:
+                del assumed[name]
+            self.droppedOptionals.extend(blamed)
+            self.isSat = self.check(selected + list(assumed.values()))
         if self.isSat == sat:
-            self.currModel = s.model()
+            self.currModel = self.lastSolver.model()
         return self
 
     class VarTypesClass: